@@ -58,7 +58,7 @@ from nodes.weather_search_node import process_weather_search
 from nodes.memory_search_node import process_memory_search
 from nodes.end_node import process_end  # 終了ノード
 from nodes.registry import get_all_nodes_info
-from utils.message_validator import MessageValidator, MessageValidationError
+from utils.message_validator import validate_messages, MessageValidationError
 
 """
 各ノードの実装における必須項目と検証要件：
@@ -73,7 +73,7 @@ from utils.message_validator import MessageValidator, MessageValidationError
      * additional_kwargs に node_info を含める必要がある
 
 2. メッセージ検証要件:
-   - 各メッセージは MessageValidator.validate_message() でチェックされる
+   - 各メッセージは validate_message() でチェックされる
    - 検証に失敗すると MessageValidationError が発生
    - 検証項目:
      * LangChain の BaseMessage を継承していること
@@ -87,6 +87,25 @@ from utils.message_validator import MessageValidator, MessageValidationError
    - 再試行回数を超えるとエラーとして処理が中止される
 """
 
+def merge_state_for_log(state, result):
+    """
+    ノードの返り値を元のstateと合成し、ログに記録する状態を作成する関数
+    
+    messagesはLangGraphと同じくadd_messagesで合成するため、ノードが差分（追加したメッセージのみ）を返した場合も、
+    既存の履歴を含む状態全体を返した場合も、同じ形の状態になる。
+    
+    Args:
+        state (dict): ノードに渡したstate
+        result (dict): ノードの返り値
+        
+    Returns:
+        dict: 合成した状態
+    """
+    merged = {**state, **result}
+    if "messages" in result:
+        merged["messages"] = add_messages(state.get("messages", []), result["messages"])
+    return merged
+
 def node_wrapper(node_func, node_name):
     """
     ノード関数をラップして、メッセージ検証と時間計測を行う関数
@@ -117,7 +136,7 @@ def node_wrapper(node_func, node_name):
             # 処理後のメッセージ検証
             try:
                 if "messages" in result and result["messages"]:
-                    MessageValidator.validate_messages(result["messages"])
+                    validate_messages(result["messages"])
             except MessageValidationError as e:
                 error_msg = f"{node_name}の処理後にメッセージ検証エラーが発生しました: {str(e)}"
                 print(f"エラー: {error_msg}")
@@ -149,8 +168,8 @@ def node_wrapper(node_func, node_name):
                 # 処理時間をログに出力
                 print(f"ノード '{node_name}' の処理時間: {processing_time:.2f}ms")
                 
-                # stateログを保存
-                save_state_log(result, node_name)
+                # stateログを保存（差分を返すノードの場合も、元のstateと合成した状態を記録する）
+                save_state_log(merge_state_for_log(state, result), node_name)
                 
                 return result
             
@@ -467,7 +486,7 @@ def process_agent_request(input_text, files_data, is_auto_response=False, is_ina
         # 最終結果のメッセージ検証
         try:
             if "messages" in result and result["messages"]:
-                MessageValidator.validate_messages(result["messages"])
+                validate_messages(result["messages"])
         except MessageValidationError as e:
             error_msg = f"最終結果のメッセージ検証エラー: {str(e)}"
             print(f"警告: {error_msg}")
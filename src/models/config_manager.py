@@ -11,6 +11,9 @@ class ConfigError(Exception):
 class ConfigManager:
     """設定ファイルの管理クラス"""
     
+    # 設定ファイルのパスごとの共有インスタンスを保持するクラス変数
+    _instances = {}
+    
     def __init__(self, settings_file_path):
         """
         ConfigManagerを初期化する
@@ -21,6 +24,36 @@ class ConfigManager:
         self.settings_file = settings_file_path
         self.settings = self._load_settings()
     
+    @classmethod
+    def get_instance(cls, settings_file_path):
+        """
+        設定ファイルのパスごとに共有のConfigManagerインスタンスを取得する
+        初回の呼び出し時のみ設定ファイルを読み込み、以降は同じインスタンスを返す
+        
+        Args:
+            settings_file_path (str): 設定ファイルのパス
+            
+        Returns:
+            ConfigManager: ConfigManagerのインスタンス
+        
+        Raises:
+            ConfigError: 設定ファイルの読み込みに失敗した場合
+        """
+        key = str(settings_file_path)
+        instance = cls._instances.get(key)
+        if instance is None:
+            instance = cls(settings_file_path)
+            cls._instances[key] = instance
+        return instance
+    
+    @classmethod
+    def clear_instances(cls):
+        """
+        共有のConfigManagerインスタンスを破棄する
+        設定ファイルを変更した後に呼び出すと、次回のget_instanceで読み込み直される
+        """
+        cls._instances.clear()
+    
     def _load_settings(self):
         """
         設定ファイルを読み込む
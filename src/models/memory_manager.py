@@ -13,6 +13,7 @@ import os
 import uuid
 import pickle
 import chromadb
+from functools import lru_cache
 from pathlib import Path
 from typing import List, Dict, Any, Optional, Union, Tuple
 from langmem import create_memory_manager
@@ -201,6 +202,53 @@ def initialize_chroma_client():
         print(f"Chromaクライアントの初期化エラー: {str(e)}")
         return None, None
 
+def _query_recent_conversations(limit: int, sort_order: str) -> list:
+    """
+    Chromaから直近の会話を取得し、指定された順序で並べる（エラー時は例外をそのまま発生させる）
+    
+    Args:
+        limit: 取得する会話の最大数
+        sort_order: ソート順（"asc"=古い順、"desc"=新しい順）
+        
+    Returns:
+        会話データとメタデータのペアのリスト
+    """
+    # Chromaクライアントを直接初期化
+    _, collection = initialize_chroma_client()
+    
+    # コレクションからすべてのデータを取得
+    all_results = collection.get()
+    
+    if all_results and 'documents' in all_results and len(all_results['documents']) > 0:
+        # メタデータを取得
+        documents = all_results['documents']
+        metadatas = all_results['metadatas']
+        
+        # 会話データとメタデータをペアにする
+        conversation_pairs = list(zip(documents, metadatas))
+        
+        # 常に新しい順（desc）でソートして最新のlimit件を取得
+        sorted_pairs = sorted(
+            conversation_pairs, 
+            key=lambda pair: pair[1].get('start_time', ''),
+            reverse=True  # 常に新しい順でソート
+        )
+        
+        # 指定された数だけ取得
+        recent_pairs = sorted_pairs[:limit]
+        
+        # sort_orderが"asc"の場合は、取得したデータを古い順に並べ替える
+        if sort_order.lower() == "asc":
+            recent_pairs = sorted(
+                recent_pairs,
+                key=lambda pair: pair[1].get('start_time', ''),
+                reverse=False  # 古い順にソート
+            )
+        
+        return recent_pairs
+    else:
+        return []
+
 def get_recent_conversations(limit: int = 5, sort_order: str = "asc") -> list:
     """
     直近の会話を取得し、指定された順序で並べる
@@ -214,44 +262,61 @@ def get_recent_conversations(limit: int = 5, sort_order: str = "asc") -> list:
         会話データとメタデータのペアのリスト
     """
     try:
-        # Chromaクライアントを直接初期化
-        _, collection = initialize_chroma_client()
+        return _query_recent_conversations(limit, sort_order)
+    except Exception as e:
+        print(f"会話履歴取得エラー: {str(e)}")
+        return []  # エラーが発生した場合は空のリストを返す
+
+def _get_stat_key(path: str) -> Optional[Tuple[int, int]]:
+    """
+    ファイルの最終更新日時（ナノ秒）とサイズを取得する
+    
+    Args:
+        path: ファイルのパス
         
-        # コレクションからすべてのデータを取得
-        all_results = collection.get()
+    Returns:
+        (最終更新日時（ナノ秒）, サイズ)、取得できない場合はNone
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+@lru_cache(maxsize=8)
+def _get_recent_conversations_by_db_state(db_state: tuple, limit: int, sort_order: str) -> list:
+    """
+    直近の会話をChromaのデータベースファイルの状態ごとにキャッシュする
+    
+    取得に失敗した場合は例外が発生するため、失敗した結果はキャッシュされない
+    """
+    return _query_recent_conversations(limit, sort_order)
+
+def get_recent_conversations_cached(limit: int = 5, sort_order: str = "asc") -> list:
+    """
+    直近の会話を取得する（Chromaのデータベースが更新されていない場合はキャッシュを返す）
+    
+    SQLiteはWALファイルに書き込んでから本体に反映する場合があるため、
+    chroma.sqlite3とchroma.sqlite3-walの両方の更新日時とサイズをキャッシュのキーにする。
+    
+    Args:
+        limit: 取得する会話の最大数（デフォルト5）
+        sort_order: ソート順（"asc"=古い順、"desc"=新しい順）
         
-        if all_results and 'documents' in all_results and len(all_results['documents']) > 0:
-            # メタデータを取得
-            documents = all_results['documents']
-            metadatas = all_results['metadatas']
-            
-            # 会話データとメタデータをペアにする
-            conversation_pairs = list(zip(documents, metadatas))
-            
-            # 常に新しい順（desc）でソートして最新のlimit件を取得
-            sorted_pairs = sorted(
-                conversation_pairs, 
-                key=lambda pair: pair[1].get('start_time', ''),
-                reverse=True  # 常に新しい順でソート
-            )
-            
-            # 指定された数だけ取得
-            recent_pairs = sorted_pairs[:limit]
-            
-            # sort_orderが"asc"の場合は、取得したデータを古い順に並べ替える
-            if sort_order.lower() == "asc":
-                recent_pairs = sorted(
-                    recent_pairs,
-                    key=lambda pair: pair[1].get('start_time', ''),
-                    reverse=False  # 古い順にソート
-                )
-            
-            return recent_pairs
-        else:
-            return []
+    Returns:
+        会話データとメタデータのペアのリスト（キャッシュと共有されるため変更しないこと）
+    """
+    path_config = PathConfig.get_instance()
+    db_path = os.path.join(str(path_config.chroma_db_dir), "chroma.sqlite3")
+    db_key = _get_stat_key(db_path)
+    if db_key is None:
+        # データベースファイルが見つからない場合はキャッシュせずに取得する
+        return get_recent_conversations(limit=limit, sort_order=sort_order)
+    try:
+        return _get_recent_conversations_by_db_state((db_key, _get_stat_key(db_path + "-wal")), limit, sort_order)
     except Exception as e:
         print(f"会話履歴取得エラー: {str(e)}")
-        return []  # エラーが発生した場合は空のリストを返す
+        return []  # エラーが発生した場合は空のリストを返す（キャッシュはしない）
 
 def parse_conversation_file(file_path: str) -> List[Dict[str, str]]:
     """
@@ -1179,6 +1244,42 @@ def load_latest_memory_content_as_string(memory_dir: str) -> Optional[str]:
         print(f"記憶ファイルの読み込みに失敗しました: {e}")
         return None
 
+@lru_cache(maxsize=8)
+def _load_memory_content(memory_file: str, mtime_ns: int, size: int) -> str:
+    """
+    記憶ファイルのcontentを文字列として読み込む（ファイルのパス・更新日時・サイズごとにキャッシュする）
+    
+    読み込みに失敗した場合は例外が発生するため、失敗した結果はキャッシュされない
+    """
+    with open(memory_file, 'rb') as f:
+        memory_obj = pickle.load(f)
+    return str(memory_obj.content)
+
+def load_latest_memory_content_cached(memory_dir: str) -> Optional[str]:
+    """
+    最新のPKLファイルのcontentを文字列として取得する（最新のファイルが変わっていない場合はキャッシュを返す）
+    
+    最新の記憶ファイルのパスと更新日時・サイズをキャッシュのキーにするため、
+    新しい記憶ファイルが保存された場合や、同じファイルが書き換えられた場合は読み込み直す。
+    
+    Args:
+        memory_dir: 記憶ファイルが格納されているディレクトリのパス
+        
+    Returns:
+        contentを文字列に変換したもの、失敗した場合はNone
+    """
+    latest_memory_file = find_latest_memory_file(memory_dir)
+    if not latest_memory_file:
+        print(f"記憶ディレクトリ {memory_dir} に記憶ファイルが見つかりません。")
+        return None
+    
+    try:
+        st = latest_memory_file.stat()
+        return _load_memory_content(str(latest_memory_file), st.st_mtime_ns, st.st_size)
+    except Exception as e:
+        print(f"記憶ファイルの読み込みに失敗しました: {e}")
+        return None
+
 def main():
     """メイン処理"""
     # パス設定を取得
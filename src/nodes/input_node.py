@@ -3,9 +3,13 @@ import os
 import json
 from datetime import datetime
 from utils.llm_utils import call_llm, parse_json_response
+from utils.message_utils import make_node_info
 from nodes.registry import register_node
 from langchain.schema import HumanMessage  # LangChainのメッセージクラスをインポート
 
+# このノードが作成するメッセージのノード情報（ノード名, ノードタイプ）
+_INPUT_NODE_INFO_STATIC = ("input_node", "user_facing")
+
 @register_node(
     name="input",
     description="ユーザー入力とファイルを処理し、テキスト化する入力ノード",
@@ -33,11 +37,7 @@ def process_input(state: Dict[str, Any], input_text: str, files_data: Optional[L
     if not files_data:
         # additional_kwargsを作成
         additional_kwargs = {
-            "node_info": {
-                "node_name": "input_node",  # ノード名
-                "node_type": "user_facing",
-                "timestamp": datetime.now().isoformat(),
-            },
+            "node_info": make_node_info(*_INPUT_NODE_INFO_STATIC),
             "file_info": "添付ファイルはありません。"
         }
         
@@ -78,11 +78,7 @@ def process_input(state: Dict[str, Any], input_text: str, files_data: Optional[L
         
         # additional_kwargsを作成（エラー情報を含む）
         additional_kwargs = {
-            "node_info": {
-                "node_name": "input_node",  # ノード名
-                "node_type": "user_facing",
-                "timestamp": datetime.now().isoformat(),
-            }
+            "node_info": make_node_info(*_INPUT_NODE_INFO_STATIC)
         }
         if files_info:
             additional_kwargs["file_info"] = files_info
@@ -113,11 +109,7 @@ def process_input(state: Dict[str, Any], input_text: str, files_data: Optional[L
     
     # additional_kwargsを作成
     additional_kwargs = {
-        "node_info": {
-            "node_name": "input_node",  # ノード名
-            "node_type": "user_facing",
-            "timestamp": datetime.now().isoformat(),
-        }
+        "node_info": make_node_info(*_INPUT_NODE_INFO_STATIC)
     }
     if files_info:
         additional_kwargs["file_info"] = files_info
@@ -2,12 +2,15 @@
 過去の会話から関連する内容を検索するノード
 """
 from typing import Dict, List, Any
-from datetime import datetime
 import uuid
+from utils.message_utils import make_node_info
 from nodes.registry import register_node
 from langchain.schema.messages import ToolMessage
 from models.memory_manager import search_conversations
 
+# このノードが作成するメッセージのノード情報（ノード名, ノードタイプ）
+_MEMORY_SEARCH_NODE_INFO_STATIC = ("memory_search_node", "service")
+
 @register_node(
     name="memory_search",
     description="過去の会話から関連する内容を検索して一文ごとに思い出すノード",
@@ -95,11 +98,7 @@ def process_memory_search(state: Dict[str, Any]) -> Dict[str, Any]:
             content=memory_search_results,
             tool_call_id=f"memory_search_{uuid.uuid4()}",
             additional_kwargs={
-                "node_info": {
-                    "node_name": "memory_search_node",
-                    "node_type": "service",
-                    "timestamp": datetime.now().isoformat(),
-                },
+                "node_info": make_node_info(*_MEMORY_SEARCH_NODE_INFO_STATIC),
                 "memory_info": {
                     "query": search_query,
                     "result_count": len(search_results)
@@ -129,11 +128,7 @@ def process_memory_search(state: Dict[str, Any]) -> Dict[str, Any]:
             content=error_message,
             tool_call_id=f"memory_search_error_{uuid.uuid4()}",
             additional_kwargs={
-                "node_info": {
-                    "node_name": "memory_search_node",
-                    "node_type": "service",
-                    "timestamp": datetime.now().isoformat(),
-                },
+                "node_info": make_node_info(*_MEMORY_SEARCH_NODE_INFO_STATIC),
                 "error": str(e)
             }
         )
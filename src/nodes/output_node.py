@@ -4,116 +4,44 @@
 from typing import Dict, List, Any, Optional
 import os
 import json
-from datetime import datetime
 from utils.api_logger import ApiLogger
 from utils.llm_utils import call_llm
-from utils.prompt_utils import load_prompt
+from utils.prompt_utils import load_prompt_cached
+from utils.message_utils import get_latest_user_input, make_node_info
 from nodes.registry import register_node
 from langchain.schema import AIMessage  # LangChainのメッセージクラスをインポート
 
-# 会話履歴を抽出する関数
-def extract_conversation_history(messages):
-    """
-    messagesリストから会話履歴を抽出する関数
-    
-    Args:
-        messages (list): メッセージのリスト
-        
-    Returns:
-        str: 整形された会話履歴
-    
-    Raises:
-        ValueError: サポートされていないメッセージ形式の場合
-    """
-    conversation = []
-    
-    for msg in messages:
-        # LangChainのメッセージオブジェクトの場合
-        if hasattr(msg, 'content') and hasattr(msg, 'type'):
-            # ノード情報を取得
-            node_info = None
-            if hasattr(msg, 'additional_kwargs') and isinstance(msg.additional_kwargs, dict):
-                node_info = msg.additional_kwargs.get("node_info", {})
-            
-            # メッセージタイプに基づいてロールを決定
-            if msg.type == "human":
-                role = "ユーザー"
-            elif msg.type == "ai":
-                role = "アシスタント"
-            elif msg.type == "system":
-                # ノード情報に基づいて表示を調整
-                node_name = node_info.get("node_name", "") if node_info else ""
-                if node_name == "planner_node":
-                    role = "思考プロセス"  # plannerノードの場合は「思考プロセス」として表示
-                else:
-                    role = "システム"
-            elif msg.type == "function" or msg.type == "tool":
-                role = "ツール"
-                # 関数名/ツール名を取得
-                name = getattr(msg, 'name', '不明なツール')
-                role = f"{role}({name})"
-            else:
-                role = msg.type
-            
-            # 基本メッセージを作成
-            message = f"{role}: {msg.content}"
-            
-            # additional_kwargsから追加情報を取得（すべてのキーを取得）
-            # すべてのメッセージタイプで実行
-            if hasattr(msg, 'additional_kwargs') and isinstance(msg.additional_kwargs, dict):
-                # すべてのkwargsの情報を追加
-                for key, value in msg.additional_kwargs.items():
-                    message += f"\n[{key}: {value}]"
-                
-            conversation.append(message)
-        # タプル形式の場合 - エラーを発生させる
-        elif isinstance(msg, tuple):
-            raise ValueError("タプル形式のメッセージはサポートされていません。LangChainのメッセージオブジェクトを使用してください。")
-        # 辞書形式の場合 - エラーを発生させる
-        elif isinstance(msg, dict):
-            raise ValueError("辞書形式のメッセージはサポートされていません。LangChainのメッセージオブジェクトを使用してください。")
-        # その他の形式 - エラーを発生させる
-        else:
-            raise ValueError(f"サポートされていないメッセージ形式です: {type(msg)}")
-    
-    return "\n\n".join(conversation)
+# このノードが作成するメッセージのノード情報（ノード名, ノードタイプ）
+_OUTPUT_NODE_INFO_STATIC = ("output_node", "user_facing")
 
-# 最新のユーザー入力を取得する関数
-def get_latest_user_input(messages):
-    """
-    messagesリストから最新のユーザー入力を取得する関数
-    
-    Args:
-        messages (list): メッセージのリスト
-        
-    Returns:
-        dict: 最新のユーザー入力情報
-    
-    Raises:
-        ValueError: サポートされていないメッセージ形式の場合
-    """
-    # 最新のHumanMessageを探す
-    for i in range(len(messages) - 1, -1, -1):
-        msg = messages[i]
-        
-        # LangChainのHumanMessageオブジェクトの場合
-        if hasattr(msg, 'content') and hasattr(msg, 'type') and msg.type == "human":
-            result = {'content': msg.content}
-            
-            # additional_kwargsからすべての情報を取得
-            if hasattr(msg, 'additional_kwargs') and isinstance(msg.additional_kwargs, dict):
-                # すべてのキーを取得
-                for key, value in msg.additional_kwargs.items():
-                    if value:
-                        result[key] = value
-            
-            return result
-        # タプル形式の場合 - エラーを発生させる
-        elif isinstance(msg, tuple):
-            raise ValueError("タプル形式のメッセージはサポートされていません。LangChainのメッセージオブジェクトを使用してください。")
-    
-    # ユーザーメッセージが見つからない場合は空の辞書を返す
-    return {'content': ''}
+# ユーザープロンプトのテンプレート（インデントを含めずにモジュール読み込み時に一度だけ構築する）
+_OUTPUT_PROMPT_TMPL = (
+    "以下の情報を基に、ユーザーへの応答を生成してください。\n"
+    "\n"
+    "## 最新のユーザー入力\n"
+    "{content}\n"
+    "\n"
+    "## 添付ファイル情報\n"
+    "{file_info}\n"
+    "\n"
+    "## ファイル内容\n"
+    "{file_content}\n"
+    "\n"
+    "## ユーザーの意図理解\n"
+    "{understanding}\n"
+    "\n"
+    "## 会話履歴\n"
+    "会話履歴はこの指示の後に続くメッセージとして渡されます。最新のユーザー入力も含まれているため、上記の「最新のユーザー入力」と重複している場合がありますが、これは意図的なものです。会話の流れを把握するために、最新の入力を会話の文脈の中で理解してください。\n"
+    "\n"
+    "ユーザーへの応答を生成してください。会話の文脈とファイル情報を考慮し、自然な応答を心がけてください。\n"
+)
+
+# エラー時のデフォルトプロンプト
+_OUTPUT_FALLBACK_PROMPT = (
+    "ユーザーへの応答を生成してください。\n"
+    "\n"
+    "エラーが発生したため、デフォルトの応答を返します。\n"
+)
 
 # プロンプトを作成する関数
 def create_output_prompt(state):
@@ -130,50 +58,29 @@ def create_output_prompt(state):
         ValueError: サポートされていないメッセージ形式の場合
     """
     try:
-        # messagesから会話履歴を抽出
+        # 会話履歴は文字列に整形せず、call_llmにLangChainのメッセージのまま渡す
         messages = state.get("messages", [])
-        conversation_history = extract_conversation_history(messages)
         
         # 最新のユーザー入力を取得
         latest_input = get_latest_user_input(messages)
         
         # システムプロンプトの読み込み
-        system_prompt = load_prompt("output_prompt.txt")
+        system_prompt = load_prompt_cached("output_prompt.txt")
         
         # ユーザープロンプトの作成
-        prompt = f"""
-        以下の情報を基に、ユーザーへの応答を生成してください。
-
-        ## 最新のユーザー入力
-        {latest_input.get('content', '')}
-        
-        ## 添付ファイル情報
-        {latest_input.get('file_info', 'なし')}
-        
-        ## ファイル内容
-        {latest_input.get('file_content', 'なし')}
-        
-        ## ユーザーの意図理解
-        {latest_input.get('understanding', 'なし')}
-        
-        ## 会話履歴
-        注意: 会話履歴には最新のユーザー入力も含まれています。上記の「最新のユーザー入力」と重複している場合がありますが、これは意図的なものです。会話の流れを把握するために、最新の入力を会話の文脈の中で理解してください。
-        
-        {conversation_history}
-        
-        ユーザーへの応答を生成してください。会話の文脈とファイル情報を考慮し、自然な応答を心がけてください。
-        """
+        prompt = _OUTPUT_PROMPT_TMPL.format(
+            content=latest_input.get('content', ''),
+            file_info=latest_input.get('file_info', 'なし'),
+            file_content=latest_input.get('file_content', 'なし'),
+            understanding=latest_input.get('understanding', 'なし'),
+        )
         
         return prompt, system_prompt
     except ValueError as e:
         # エラーが発生した場合はログに出力し、デフォルトのプロンプトを返す
         print(f"プロンプト作成エラー: {str(e)}")
-        system_prompt = load_prompt("output_prompt.txt")
-        prompt = """
-        ユーザーへの応答を生成してください。
-        
-        エラーが発生したため、デフォルトの応答を返します。
-        """
+        system_prompt = load_prompt_cached("output_prompt.txt")
+        prompt = _OUTPUT_FALLBACK_PROMPT
         return prompt, system_prompt
 
 @register_node(
@@ -205,7 +112,14 @@ def process_output(state: Dict[str, Any]) -> Dict[str, Any]:
         prompt, system_prompt = create_output_prompt(state)
         
         # LLMを呼び出し
-        response = call_llm(prompt, system_prompt, api_name="output_node")
+        # 会話履歴はstateのメッセージとしてそのまま渡し、指示はシステムプロンプトの後に続ける
+        # 毎回同じシステムプロンプトを先頭に置き、プロンプトキャッシュの対象とする
+        response = call_llm(
+            state=state,
+            system_prompt=[system_prompt, prompt],
+            api_name="output_node",
+            cache_breakpoint=1
+        )
         
         # responseをそのまま使用（call_llm関数内ですでにパース済み）
         # 応答テキストを取得（responseがdictの場合はcontentを取得、文字列の場合はそのまま使用）
@@ -215,11 +129,7 @@ def process_output(state: Dict[str, Any]) -> Dict[str, Any]:
         ai_message = AIMessage(
             content=response_text,
             additional_kwargs={
-                "node_info": {
-                    "node_name": "output_node",  # ノード名
-                    "node_type": "user_facing",
-                    "timestamp": datetime.now().isoformat(),
-                }
+                "node_info": make_node_info(*_OUTPUT_NODE_INFO_STATIC)
             }
         )
         
@@ -241,11 +151,7 @@ def process_output(state: Dict[str, Any]) -> Dict[str, Any]:
         ai_message = AIMessage(
             content=error_response,
             additional_kwargs={
-                "node_info": {
-                    "node_name": "output_node",  # ノード名
-                    "node_type": "user_facing",
-                    "timestamp": datetime.now().isoformat(),
-                },
+                "node_info": make_node_info(*_OUTPUT_NODE_INFO_STATIC),
                 "error": str(e)
             }
         )
@@ -6,6 +6,12 @@ from typing import Dict, List, Any, Callable, Optional
 # ノード情報を格納する辞書
 _NODE_REGISTRY: Dict[str, Dict[str, Any]] = {}
 
+# get_all_nodes_infoで公開しないノード（統合ノードに置き換えられたノード）
+_EXCLUDED_NODES = frozenset({"input", "planner", "output"})
+
+# 公開用のノード情報（関数参照と除外ノードを取り除いたもの）を登録時に作成して保持する辞書
+_PUBLIC_NODE_VIEW: Dict[str, Dict[str, Any]] = {}
+
 def register_node(
     name: str,
     description: str,
@@ -23,6 +29,8 @@ def register_node(
             "input_requirements": input_requirements,
             "output_fields": output_fields
         }
+        if name not in _EXCLUDED_NODES:
+            _PUBLIC_NODE_VIEW[name] = {k: v for k, v in _NODE_REGISTRY[name].items() if k != "function"}
         return func
     return decorator
 
@@ -32,14 +40,9 @@ def get_node_info(node_name: str) -> Dict[str, Any]:
 
 def get_all_nodes_info() -> Dict[str, Dict[str, Any]]:
     """すべてのノード情報を取得する"""
-    # 関数参照を除外したコピーを返す
-    # また、特定のノード（input, planner, output）を除外する
-    excluded_nodes = ["input", "planner", "output"]  # 統合ノードに置き換えられたノードを除外
-    return {
-        name: {k: v for k, v in info.items() if k != "function"}
-        for name, info in _NODE_REGISTRY.items()
-        if name not in excluded_nodes  # 除外リストにないノードのみを返す
-    }
+    # 登録時に作成済みの、関数参照と特定のノード（input, planner, output）を除外した情報を返す
+    # 呼び出し元での変更がレジストリに影響しないよう、ノードごとの辞書もコピーする（従来と同じく、値のリストは共有する）
+    return {name: dict(info) for name, info in _PUBLIC_NODE_VIEW.items()}
 
 def get_node_function(node_name: str) -> Optional[Callable]:
     """ノード名から関数を取得する"""
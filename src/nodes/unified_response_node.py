@@ -3,17 +3,35 @@
 """
 from typing import Dict, List, Any, Optional
 import os
+import logging
 import json
+import copy
 from datetime import datetime
 from utils.api_logger import ApiLogger
 from utils.llm_utils import call_llm, parse_json_response
 from utils.prompt_utils import load_prompt
+from utils.message_utils import get_latest_user_input, make_node_info
 from nodes.registry import register_node
 from models.config_manager import ConfigManager
 from utils.path_config import PathConfig
-from models.memory_manager import load_latest_memory_content_as_string, get_recent_conversations
+from models.memory_manager import load_latest_memory_content_cached, get_recent_conversations_cached
 from langchain.schema import HumanMessage, AIMessage, SystemMessage  # LangChainのメッセージクラスをインポート
 
+# 毎ターン出力される経過情報はDEBUGレベルでログに出力する（エラーは従来どおりprintで出力する）
+logger = logging.getLogger(__name__)
+
+# このノードが作成するメッセージのノード情報（ノード名, ノードタイプ）
+_USER_FACING_NODE_INFO_STATIC = ("unified_response_node", "user_facing")
+_INTERNAL_NODE_INFO_STATIC = ("unified_response_node", "internal")
+
+# 月（1-12）から季節への対応表（インデックスは月-1）
+_SEASONS = ("冬", "冬", "春", "春", "春", "夏", "夏", "夏", "秋", "秋", "秋", "冬")
+
+# 曜日の表記（datetime.weekday()の戻り値に対応）
+_WEEKDAYS = ("月", "火", "水", "木", "金", "土", "日")
+
+# 時（0-23）から時間帯への対応表
+_HOUR_PERIODS = ("深夜",) * 5 + ("朝",) * 6 + ("昼",) * 6 + ("夕方",) * 4 + ("夜",) * 3
 
 # 季節を取得する関数
 def get_season(month):
@@ -26,14 +44,7 @@ def get_season(month):
     Returns:
         str: 季節名
     """
-    if 3 <= month <= 5:
-        return "春"
-    elif 6 <= month <= 8:
-        return "夏"
-    elif 9 <= month <= 11:
-        return "秋"
-    else:
-        return "冬"
+    return _SEASONS[month - 1]
 
 
 # 時間帯を取得する関数
@@ -47,41 +58,51 @@ def get_time_period(hour):
     Returns:
         str: 時間帯
     """
-    if 5 <= hour <= 10:
-        return "朝"
-    elif 11 <= hour <= 16:
-        return "昼"
-    elif 17 <= hour <= 20:
-        return "夕方"
-    elif 21 <= hour <= 23:
-        return "夜"
-    else:
-        return "深夜"
+    return _HOUR_PERIODS[hour]
 
 
+# 状況コンテキストの使い方に関する指示（日時によらず一定のため、プロンプトキャッシュの対象となる固定部分に置く）
+_SITUATIONAL_CONTEXT_PREAMBLE = (
+    "「現在の日時」として示す時間情報は、現在進行中の会話における発話タイミング（ユーザーからの入力に対する応答、またはミクからの自発的な話しかけ）を示しています。\n"
+    "必要に応じて日時情報を参照して、時間帯や季節に応じた応答をしてください。ただし、必要がなければ無理に触れなくて構いません。\n"
+    "例えば、朝なら「おはよう」、夜なら「こんばんは」など時間帯に応じた挨拶や、"
+    "季節に関連した話題（桜、紅葉、雪、暑さ寒さなど）、"
+    "曜日に応じた配慮（平日の忙しさ、週末のリラックスなど）を自然に取り入れてください。"
+    "ただし、会話時刻が深夜の場合、前日からずっと起きている可能性があることを考慮してください。"
+    "深夜の場合は夜更かしや体調への気遣いを、早朝なら早起きへの労いを示してください。"
+)
+
 # 状況コンテキストプロンプトを生成する関数
 def get_situational_context_prompt():
     """
     現在の状況に関するコンテキスト情報を含むプロンプトを生成する関数
     
+    使い方の指示は_SITUATIONAL_CONTEXT_PREAMBLEに分離しており、ここでは日時情報のみを返す。
+    時刻は分単位ではなく日付と時間帯の粒度にまとめ、同じ時間帯の間は同じ内容になるようにしている。
+    
     Returns:
-        str: 状況コンテキストプロンプト
+        str: 状況コンテキストプロンプト（現在の日時）
     """
     current_time = datetime.now()
     
     return (
-        "以下の時間情報は、現在進行中の会話における発話タイミング（ユーザーからの入力に対する応答、またはミクからの自発的な話しかけ）を示しています。\n"
-        "必要に応じて日時情報を参照して、時間帯や季節に応じた応答をしてください。ただし、必要がなければ無理に触れなくて構いません。\n"
-        f"日本時間: {current_time.strftime('%Y年%m月%d日 %H時%M分')} ({['月','火','水','木','金','土','日'][current_time.weekday()]}曜日)\n"
+        "## 現在の日時\n"
+        f"日本時間: {current_time.strftime('%Y年%m月%d日')} ({_WEEKDAYS[current_time.weekday()]}曜日)\n"
         f"季節: {get_season(current_time.month)}\n"
         f"時間帯: {get_time_period(current_time.hour)}\n"
-        "例えば、朝なら「おはよう」、夜なら「こんばんは」など時間帯に応じた挨拶や、"
-        "季節に関連した話題（桜、紅葉、雪、暑さ寒さなど）、"
-        "曜日に応じた配慮（平日の忙しさ、週末のリラックスなど）を自然に取り入れてください。"
-        "ただし、会話時刻が深夜の場合、前日からずっと起きている可能性があることを考慮してください。"
-        "深夜の場合は夜更かしや体調への気遣いを、早朝なら早起きへの労いを示してください。"
     )
 
+# ファイルタイプごとの説明（画像はLLMが生成した説明を使用し、ここにないタイプは「{タイプ}ファイル」とする）
+_FILE_TYPE_DESCRIPTIONS = {"音声": "音声ファイル"}
+
+# メッセージのtypeごとの、最後に実行されたツール名の取得関数
+# tool/functionはツール名、SystemMessageはadditional_kwargsに設定されたactionを返す
+_TOOL_NAME_EXTRACTORS = {
+    "tool": lambda msg: getattr(msg, 'name', "") or "",
+    "function": lambda msg: getattr(msg, 'name', "") or "",
+    "system": lambda msg: getattr(msg, 'additional_kwargs', {}).get('action', ""),
+}
+
 # 最後に実行されたツール名を取得する関数
 def get_last_tool_name(messages):
     """
@@ -99,58 +120,9 @@ def get_last_tool_name(messages):
     # 最新のメッセージを取得
     latest_message = messages[-1]
     
-    # ToolMessageの場合
-    if str(type(latest_message).__name__) == "ToolMessage":
-        return latest_message.name
-    
-    # typeがtoolまたはfunctionの場合
-    if hasattr(latest_message, 'type') and latest_message.type in ["tool", "function"]:
-        if hasattr(latest_message, 'name'):
-            return latest_message.name
-    
-    # SystemMessageでactionが設定されている場合
-    if hasattr(latest_message, 'type') and latest_message.type == "system":
-        if hasattr(latest_message, 'additional_kwargs'):
-            return latest_message.additional_kwargs.get('action', "")
-    
-    return ""
-
-# 最新のユーザー入力を取得する関数
-def get_latest_user_input(messages):
-    """
-    messagesリストから最新のユーザー入力を取得する関数
-    
-    Args:
-        messages (list): メッセージのリスト
-        
-    Returns:
-        dict: 最新のユーザー入力情報
-    
-    Raises:
-        ValueError: サポートされていないメッセージ形式の場合
-    """
-    # 最新のHumanMessageを探す
-    for i in range(len(messages) - 1, -1, -1):
-        msg = messages[i]
-        
-        # LangChainのHumanMessageオブジェクトの場合
-        if hasattr(msg, 'content') and hasattr(msg, 'type') and msg.type == "human":
-            result = {'content': msg.content}
-            
-            # additional_kwargsからすべての情報を取得
-            if hasattr(msg, 'additional_kwargs') and isinstance(msg.additional_kwargs, dict):
-                # すべてのキーを取得
-                for key, value in msg.additional_kwargs.items():
-                    if value:
-                        result[key] = value
-            
-            return result
-        # タプル形式の場合 - エラーを発生させる
-        elif isinstance(msg, tuple):
-            raise ValueError("タプル形式のメッセージはサポートされていません。LangChainのメッセージオブジェクトを使用してください。")
-    
-    # ユーザーメッセージが見つからない場合は空の辞書を返す
-    return {'content': ''}
+    # メッセージのtypeに応じた取得関数で判定（ToolMessageのtypeは"tool"）
+    extractor = _TOOL_NAME_EXTRACTORS.get(getattr(latest_message, 'type', None))
+    return extractor(latest_message) if extractor is not None else ""
 
 # スキーマから例を生成する関数
 def generate_example_from_schema(schema):
@@ -203,6 +175,36 @@ def generate_example_from_schema(schema):
     
     return example
 
+# スキーマごとに作成済みの例ビルダー（id(schema) -> (schema, builder)）
+# schema自体も保持し、同じidが別のオブジェクトに再利用されないようにする
+_example_builders = {}
+
+# スキーマから例を生成する関数を作成する関数
+def compile_example_builder(schema):
+    """
+    スキーマから例を生成する関数（例ビルダー）を作成する関数
+    
+    スキーマの走査は作成時に一度だけ行い、例ビルダーは作成済みの例のコピーを返すだけにする。
+    同じスキーマオブジェクトに対しては同じ例ビルダーを返す。
+    
+    Args:
+        schema (Dict[str, Any]): JSONスキーマ
+        
+    Returns:
+        Callable[[], Dict[str, Any]]: スキーマに基づく例を返す関数
+    """
+    cached = _example_builders.get(id(schema))
+    if cached is not None and cached[0] is schema:
+        return cached[1]
+    
+    example = generate_example_from_schema(schema)
+    
+    def build_example():
+        return copy.deepcopy(example)
+    
+    _example_builders[id(schema)] = (schema, build_example)
+    return build_example
+
 #回答時のJSONスキーマを定義
 EXPECTED_SCHEMA = {
     "input_processing": {
@@ -250,6 +252,100 @@ EXPECTED_SCHEMA = {
     }
 }
 
+# EXPECTED_SCHEMAの例ビルダー
+_EXAMPLE_BUILDER = compile_example_builder(EXPECTED_SCHEMA)
+
+# スキーマから生成した回答例のJSON文字列（EXPECTED_SCHEMAは変更されないため一度だけ生成する）
+_SCHEMA_EXAMPLE_JSON = json.dumps(_EXAMPLE_BUILDER(), ensure_ascii=False, indent=4)
+
+# 出力フォーマットの指示（回答例はEXPECTED_SCHEMAから生成した固定の内容のため、モジュール読み込み時に一度だけ構築する）
+_FORMAT_PROMPT = f"""
+        # 出力フォーマットの指示
+        必ず、絶対に以下の形式でこのタスクに対する出力としてJSONオブジェクトを返してください（マークダウンのコードブロックで囲んでください）:
+        ```json
+        {_SCHEMA_EXAMPLE_JSON}
+        ```
+        
+        以下の制約を厳守してください：
+        1. どのような返答を帰す場合でも、jsonオブジェクトを出力し、マークダウンのコードブロック(```json)で囲む
+        2. 直接返答する場合もjsonオブジェクトを返し、その中のresponseフィールドにユーザーへの応答テキストを含めてください
+        3. JSONオブジェクトのみを返し、前後に説明文を含めない
+        4. 指定されたすべてのフィールドを含める
+        5. 指定されていないフィールドは含めない
+        6. inactivity_timeoutフィールドには、以下のいずれかを設定してください：
+           - ユーザーからの応答を期待する場合は秒数を正の整数で設定（例：60）
+           - 応答を要求しない場合は -1 を設定
+
+        ## 正しい応答例（応答を期待する場合のjsonオブジェクトの例）
+        ```json
+        {{
+            "input_processing": {{
+                "file_content_description": "添付ファイルの内容の詳細な説明",
+                "combined_understanding": "入力テキストとファイルから得られる本質的な理解"
+            }},
+            "planning": {{
+                "requires_tool": false,
+                "reasoning": "この判断をした理由"
+            }},
+            "response": "こんにちは、お手伝いできることはある？",
+            "inactivity_timeout": 60
+        }}
+        ```
+
+        ## 正しい応答例（応答を要求しない場合のjsonオブジェクトの例）
+        ```json
+        {{
+            "input_processing": {{
+                "file_content_description": "添付ファイルの内容の詳細な説明",
+                "combined_understanding": "入力テキストとファイルから得られる本質的な理解"
+            }},
+            "planning": {{
+                "requires_tool": false,
+                "reasoning": "この判断をした理由"
+            }},
+            "response": "おやすみなさい、良い夢を。",
+            "inactivity_timeout": -1
+        }}
+        ```
+
+        ## 不正な応答例(jsonオブジェクトではなく、テキストのみの応答)
+        "こんにちは、お手伝いできることはある？"
+
+        # 注意
+        【重要】単なるテキスト応答は絶対に返さないでください。必ず上記のJSONスキーマに従った応答を返してください。
+        この指示は最優先事項です。どのような状況でも、必ずJSONフォーマットで応答してください。
+        """
+
+# 会話指示プロンプト（固定の内容）
+_INSTRUCTION_PROMPT = """
+        これより下が、今回のユーザーとあなたの会話、及びあなたが実施した行動です。
+        あなたはAIエージェントなので、行動をしている場合があります。
+        次の行動判断の参考にしてください。
+        データは構造化されていますが、全ての内容を参照して構いません。
+        ただし、出力する形式は以下の形式ではなく、json形式です。
+        """
+
+# ベースのシステムプロンプトを取得する関数
+def get_base_system_prompt():
+    """
+    統合ノード用のベースのシステムプロンプトを取得する関数
+    
+    読み込んだ内容はload_promptがファイルの更新時刻とともにキャッシュするため、
+    実行中にプロンプトファイルを編集した場合は次の呼び出しで読み込み直される。
+    
+    Returns:
+        str: ベースのシステムプロンプト
+    """
+    return load_prompt("unified_response_prompt.txt")
+
+# get_unified_system_promptsが返すシステムプロンプトのうち、先頭の固定部分の件数
+# （ベースのシステムプロンプト、状況コンテキストの指示、出力フォーマットの指示）
+_STATIC_SYSTEM_PROMPT_COUNT = 3
+
+# 応答をストリーミングで受け取り、JSONが閉じた時点で受信を打ち切るか（環境変数MIKU_LLM_STREAM=1で有効にする）
+# 打ち切った場合は使用量などのメタデータやJSONの後に続くテキストを受信しないため、デフォルトでは無効
+_STREAM_RESPONSE = os.environ.get("MIKU_LLM_STREAM", "0") == "1"
+
 def get_unified_system_prompts(state):
     """
     統合ノード用のシステムプロンプトを取得する関数
@@ -270,34 +366,35 @@ def get_unified_system_prompts(state):
         
         # 利用可能なノード情報を整形（前回のツールを除外）
         available_nodes = state.get("available_nodes", {})
-        available_nodes_str = ""
+        available_node_lines = []
         for name, info in available_nodes.items():
             # 統合ノードと前回使用したツールを除外
             if name not in ["unified_response", last_tool_name]:
                 capabilities = ", ".join(info.get("capabilities", []))
-                available_nodes_str += f"- {name}: {info.get('description', '説明なし')} ({capabilities})\n"
+                available_node_lines.append(f"- {name}: {info.get('description', '説明なし')} ({capabilities})")
+        available_nodes_str = "\n".join(available_node_lines)
         
         # 前回のツール情報をログに出力
         if last_tool_name:
-            print(f"前回使用したツール '{last_tool_name}' を利用可能なツールから除外します")
+            logger.debug("前回使用したツール '%s' を利用可能なツールから除外します", last_tool_name)
         
         # システムプロンプトの読み込み
-        base_system_prompt = load_prompt("unified_response_prompt.txt")
+        base_system_prompt = get_base_system_prompt()
         
-        # 最新のメモリ内容を取得
+        # 最新のメモリ内容を取得（記憶ディレクトリが更新されていなければキャッシュを使用）
         path_config = PathConfig.get_instance()
         memory_dir = str(path_config.langmem_db_dir)
-        memory_content_str = load_latest_memory_content_as_string(memory_dir)
+        memory_content_str = load_latest_memory_content_cached(memory_dir)
         if memory_content_str:
             memory_content = "以下の内容はLangMemという記憶を階層化して保存するライブラリに記述されたあなたとマスターなどの会話の記録です。これまでの会話などをあなたがしてきたという前提に立って会話をしてください。" + memory_content_str
         else:
             memory_content = "記憶ファイルが見つかりません。今回の会話があなたとユーザーの初めての会話です。「はじめまして」などの挨拶から会話してください。"
         
-        # 直近の会話履歴を取得
-        recent_conversations = get_recent_conversations(limit=5, sort_order="asc")
-        recent_conversations_str = ""
+        # 直近の会話履歴を取得（Chromaのデータベースが更新されていなければキャッシュを使用）
+        recent_conversations = get_recent_conversations_cached(limit=5, sort_order="asc")
+        recent_conversation_parts = []
 
-        # リストの内容を文字列に変換
+        # リストの内容を文字列に変換（各会話をリストに集めて最後に一度だけ連結する）
         if recent_conversations:
             for idx, (document, metadata) in enumerate(recent_conversations):
                 # 会話全体のメタデータを取得
@@ -306,11 +403,14 @@ def get_unified_system_prompts(state):
                 participant = metadata.get('participant', '不明')
                 
                 # 会話情報を追加
-                recent_conversations_str += f"### 会話 {idx+1}\n"
-                recent_conversations_str += f"- 会話全体の開始時間: {start_time}\n"
-                recent_conversations_str += f"- 会話全体の終了時間: {end_time}\n"
-                recent_conversations_str += f"- 参加者: {participant}\n"
-                recent_conversations_str += f"- 内容:\n{document}\n\n"
+                recent_conversation_parts.append(
+                    f"### 会話 {idx+1}\n"
+                    f"- 会話全体の開始時間: {start_time}\n"
+                    f"- 会話全体の終了時間: {end_time}\n"
+                    f"- 参加者: {participant}\n"
+                    f"- 内容:\n{document}\n\n"
+                )
+        recent_conversations_str = "".join(recent_conversation_parts)
 
         recent_conversations_content = "\n\n## 直近の会話履歴\n以下は、この会話が始める前までの、あなたとマスターの間で最近行われた会話です。これらの会話内容を考慮して応答を生成してください。\n\n" + recent_conversations_str
         
@@ -424,16 +524,15 @@ def get_unified_system_prompts(state):
         # スキーマを使用
         expected_schema = EXPECTED_SCHEMA
         
-        # スキーマから例を生成
-        schema_example = generate_example_from_schema(expected_schema)
-        
         # 状況コンテキストプロンプトを追加
         situational_context_prompt = get_situational_context_prompt()
 
         
         
-        # システムプロンプトのリストを作成（常にformat_promptを含める）
-        system_prompts = [base_system_prompt, task_prompt, situational_context_prompt]
+        # システムプロンプトのリストを作成（常に出力フォーマットの指示を含める）
+        # 呼び出しごとに変わらない固定部分を先頭に並べ、プロンプトキャッシュの対象とする
+        # 固定部分の件数を変える場合は_STATIC_SYSTEM_PROMPT_COUNTも合わせて変更すること
+        system_prompts = [base_system_prompt, _SITUATIONAL_CONTEXT_PREAMBLE, _FORMAT_PROMPT]
         
         # メモリ内容が取得できた場合、それをシステムプロンプトのリストに追加
         if memory_content:
@@ -444,81 +543,19 @@ def get_unified_system_prompts(state):
         if recent_conversations_content:
             system_prompts.append(recent_conversations_content)
 
-        # 出力フォーマット指示
-        format_prompt = f"""
-        # 出力フォーマットの指示
-        必ず、絶対に以下の形式でこのタスクに対する出力としてJSONオブジェクトを返してください（マークダウンのコードブロックで囲んでください）:
-        ```json
-        {json.dumps(schema_example, ensure_ascii=False, indent=4)}
-        ```
-        
-        以下の制約を厳守してください：
-        1. どのような返答を帰す場合でも、jsonオブジェクトを出力し、マークダウンのコードブロック(```json)で囲む
-        2. 直接返答する場合もjsonオブジェクトを返し、その中のresponseフィールドにユーザーへの応答テキストを含めてください
-        3. JSONオブジェクトのみを返し、前後に説明文を含めない
-        4. 指定されたすべてのフィールドを含める
-        5. 指定されていないフィールドは含めない
-        6. inactivity_timeoutフィールドには、以下のいずれかを設定してください：
-           - ユーザーからの応答を期待する場合は秒数を正の整数で設定（例：60）
-           - 応答を要求しない場合は -1 を設定
-
-        ## 正しい応答例（応答を期待する場合のjsonオブジェクトの例）
-        ```json
-        {{
-            "input_processing": {{
-                "file_content_description": "添付ファイルの内容の詳細な説明",
-                "combined_understanding": "入力テキストとファイルから得られる本質的な理解"
-            }},
-            "planning": {{
-                "requires_tool": false,
-                "reasoning": "この判断をした理由"
-            }},
-            "response": "こんにちは、お手伝いできることはある？",
-            "inactivity_timeout": 60
-        }}
-        ```
-
-        ## 正しい応答例（応答を要求しない場合のjsonオブジェクトの例）
-        ```json
-        {{
-            "input_processing": {{
-                "file_content_description": "添付ファイルの内容の詳細な説明",
-                "combined_understanding": "入力テキストとファイルから得られる本質的な理解"
-            }},
-            "planning": {{
-                "requires_tool": false,
-                "reasoning": "この判断をした理由"
-            }},
-            "response": "おやすみなさい、良い夢を。",
-            "inactivity_timeout": -1
-        }}
-        ```
-
-        ## 不正な応答例(jsonオブジェクトではなく、テキストのみの応答)
-        "こんにちは、お手伝いできることはある？"
-
-        # 注意
-        【重要】単なるテキスト応答は絶対に返さないでください。必ず上記のJSONスキーマに従った応答を返してください。
-        この指示は最優先事項です。どのような状況でも、必ずJSONフォーマットで応答してください。
-        """
-        # format_promptをここで追加
-        system_prompts.append(format_prompt)
+        # ターンごとに変わるタスク指示と現在の日時は固定部分の後ろに置く
+        system_prompts.append(task_prompt)
+        system_prompts.append(situational_context_prompt)
 
         # 会話指示プロンプトを追加
-        # TODO: instruction_promptの配置について検討中
+        # 「これより下が会話」という指示のため、固定の文面だが常に最後に置く
+        # TODO: _INSTRUCTION_PROMPTの配置について検討中
         # - 現在は統合ノード内で生成・追加
         # - 将来的にcall_llm側への移動を検討（他のLLM呼び出しノードとの共通化のため）
         # - 移動のメリット: 汎用性向上、責任分離、保守性向上
         # - 移動のデメリット: 柔軟性低下、依存関係変更
         # - 他のノードでのLLM使用パターンを調査してから最終決定予定
-        instruction_prompt = f"""
-        これより下が、今回のユーザーとあなたの会話、及びあなたが実施した行動です。
-        あなたはAIエージェントなので、行動をしている場合があります。
-        次の行動判断の参考にしてください。
-        データは構造化されていますが、全ての内容を参照して構いません。
-        ただし、出力する形式は以下の形式ではなく、json形式です。
-        """
-        system_prompts.append(instruction_prompt)
+        system_prompts.append(_INSTRUCTION_PROMPT)
         
         return system_prompts, expected_schema
     except ValueError as e:
@@ -543,9 +580,14 @@ def process_unified_response(state: Dict[str, Any], input_text: str, files_data:
         files_data (List[Dict[str, Any]], optional): 添付ファイルのblobデータリスト
         
     Returns:
-        Dict[str, Any]: 更新された状態
+        Dict[str, Any]: 更新するstateの差分
+            エラー時も含めて更新したフィールドのみを返し、messagesにはこのノードで追加したメッセージのみを含める
+            （既存の履歴への追加はStateのmessagesに設定されたadd_messagesリデューサーが行う）
     """
     try:
+        # メッセージのタイムスタンプは、入力を受け取った時刻と応答を受け取った時刻の2回だけ取得する
+        _ts = datetime.now().isoformat()
+        
         # ファイルデータがない場合は空リストを使用
         if files_data is None:
             files_data = []
@@ -555,66 +597,62 @@ def process_unified_response(state: Dict[str, Any], input_text: str, files_data:
         if is_inactivity_reminder:
             input_text = "（応答なし）"
         
-        # ファイル情報の文字列を作成
-        files_info = ""
-        file_extensions = []
-        if files_data:
-            file_extensions = [os.path.splitext(f.get("filename", ""))[1] for f in files_data]
-            extensions_str = ", ".join(file_extensions)
-            files_info = f"{len(files_data)}個のファイルが添付されています。({extensions_str})"
-        
-        # additional_kwargsを作成
-        additional_kwargs = {
-            "node_info": {
-                "node_name": "unified_response_node",  # ノード名
-                "node_type": "user_facing",
-                "timestamp": datetime.now().isoformat(),
-            }
-        }
-        if files_info:
-            additional_kwargs["file_info"] = files_info
-        
-        # HumanMessageオブジェクトを作成（contentにはinput_textのみを含め、他の情報はadditional_kwargsに移動）
-        user_message = HumanMessage(
-            content=input_text,
-            additional_kwargs=additional_kwargs
-        )
-        
         # 入力処理の結果をstateに追加
         messages = state.get("messages", [])
         skip_human_message = False
         
         # 最新のメッセージがツール関連かどうかをチェック
         if messages:
-            latest_message = messages[-1]
-            # ToolMessageクラスのインスタンスかどうかをチェック
-            if str(type(latest_message).__name__) == "ToolMessage":
-                print("ToolMessageの後のため、HumanMessageの追加をスキップします")
-                skip_human_message = True
-            # typeがtoolまたはfunctionの場合
-            elif hasattr(latest_message, 'type') and latest_message.type in ["tool", "function"]:
-                print("ツール/関数メッセージの後のため、HumanMessageの追加をスキップします")
+            # typeがtoolまたはfunctionの場合（ToolMessageのtypeは"tool"）
+            if getattr(messages[-1], 'type', None) in ("tool", "function"):
+                logger.debug("ツール/関数メッセージの後のため、HumanMessageの追加をスキップします")
                 skip_human_message = True
 
+        # このノードで追加するメッセージ
+        # 返り値には追加分のみを含め、既存の履歴への追加はLangGraphのadd_messagesリデューサーに任せる
+        added_messages = []
+        user_message = None
         
-        if not skip_human_message:
+        if skip_human_message:
+            # ツール/関数メッセージの後の場合はHumanMessageを作成しない
             state_with_input = {
                 **state,  # 既存の状態を維持
                 "input_text": input_text,
-                "messages": state.get("messages", []) + [user_message],  # HumanMessageオブジェクトを追加
             }
         else:
+            # ファイル情報の文字列を作成
+            files_info = ""
+            if files_data:
+                extensions_str = ", ".join(os.path.splitext(f.get("filename", ""))[1] for f in files_data)
+                files_info = f"{len(files_data)}個のファイルが添付されています。({extensions_str})"
+            
+            # additional_kwargsを作成
+            additional_kwargs = {
+                "node_info": make_node_info(*_USER_FACING_NODE_INFO_STATIC, _ts)
+            }
+            if files_info:
+                additional_kwargs["file_info"] = files_info
+            
+            # HumanMessageオブジェクトを作成（contentにはinput_textのみを含め、他の情報はadditional_kwargsに移動）
+            user_message = HumanMessage(
+                content=input_text,
+                additional_kwargs=additional_kwargs
+            )
+            added_messages.append(user_message)  # HumanMessageオブジェクトを追加
+            
+            # LLMに渡す状態（会話履歴には今回のユーザー入力を含める）
             state_with_input = {
                 **state,  # 既存の状態を維持
                 "input_text": input_text,
+                "messages": [*messages, user_message],
             }
         
         # システムプロンプトとスキーマの取得
         system_prompts, expected_schema = get_unified_system_prompts(state_with_input)
         
-        # 設定を読み込み
+        # 設定を取得（設定ファイルは初回のみ読み込まれる）
         path_config = PathConfig.get_instance()
-        config_manager = ConfigManager(path_config.settings_file)
+        config_manager = ConfigManager.get_instance(path_config.settings_file)
         
         # デフォルトのLLMプロバイダを取得
         default_provider = config_manager.get_default_llm_provider()
@@ -627,9 +665,14 @@ def process_unified_response(state: Dict[str, Any], input_text: str, files_data:
                 files_data=files_data,
                 api_name="unified_response_node",
                 llm_provider=default_provider,
-                expected_schema=expected_schema
+                expected_schema=expected_schema,
+                cache_breakpoint=_STATIC_SYSTEM_PROMPT_COUNT,
+                stream=_STREAM_RESPONSE  # 有効な場合は応答のJSONが閉じた時点で受信を打ち切る
             )
             
+            # 応答を受け取った時刻（以降に作成するメッセージとファイル情報で共通）
+            _ts = datetime.now().isoformat()
+            
             # 応答から情報を取得
             input_processing = response.get("input_processing", {})
             file_content_description = input_processing.get("file_content_description", "ファイルなし")
@@ -646,6 +689,7 @@ def process_unified_response(state: Dict[str, Any], input_text: str, files_data:
         except Exception as parse_error:
             # JSONパースエラーを含むすべてのエラーを処理
             print(f"レスポンス処理エラー: {str(parse_error)}")
+            _ts = datetime.now().isoformat()
             
             # エラー応答を生成
             error_message = f"レスポンス処理エラー: {str(parse_error)}"
@@ -655,77 +699,56 @@ def process_unified_response(state: Dict[str, Any], input_text: str, files_data:
             ai_message = AIMessage(
                 content=response_text,
                 additional_kwargs={
-                    "node_info": {
-                        "node_name": "unified_response_node",
-                        "node_type": "user_facing",
-                        "timestamp": datetime.now().isoformat(),
-                    },
+                    "node_info": make_node_info(*_USER_FACING_NODE_INFO_STATIC, _ts),
                     "error": error_message
                 }
             )
             
-            # Stateに情報を追加
-            updated_state = {
-                **state,
+            # 更新するstateの差分（正常時と同じく、元のstateとの合成はLangGraphが行う）
+            return {
                 "input_text": input_text,
                 "files": [],
                 "processed_input": "入力情報の処理に失敗しました",
-                "messages": state.get("messages", []) + [ai_message],
+                "messages": [ai_message],
                 "success": False,
                 "response": response_text,
                 "next_node": "end",
                 "error": error_message
             }
-            
-            return updated_state
         
         # ファイル情報を処理（blobデータを除去し、説明を追加）
+        # タイムスタンプは応答を受け取った時刻を全ファイルで共通に使う
         processed_files = []
-        for file_data in files_data:
-            # blobデータを除いたファイル情報をコピー
-            processed_file = {
-                "filename": file_data.get("filename", ""),
-                "type": file_data.get("type", ""),
-                "content_type": file_data.get("content_type", ""),
-                "size": file_data.get("size", 0),
-                "timestamp": datetime.now().isoformat()
-            }
-            
-            # ファイルタイプに応じた説明を追加
-            if file_data.get("type") == "画像":
-                processed_file["description"] = file_content_description
-            elif file_data.get("type") == "音声":
-                processed_file["description"] = "音声ファイル"
-            else:
-                processed_file["description"] = f"{file_data.get('type', '不明')}ファイル"
-            
-            processed_files.append(processed_file)
+        if files_data:
+            type_descriptions = {**_FILE_TYPE_DESCRIPTIONS, "画像": file_content_description}
+            for file_data in files_data:
+                file_type = file_data.get("type", "")
+                
+                # blobデータを除いたファイル情報をコピーし、ファイルタイプに応じた説明を追加
+                processed_files.append({
+                    "filename": file_data.get("filename", ""),
+                    "type": file_type,
+                    "content_type": file_data.get("content_type", ""),
+                    "size": file_data.get("size", 0),
+                    "timestamp": _ts,
+                    "description": type_descriptions[file_type] if file_type in type_descriptions else f"{file_data.get('type', '不明')}ファイル",
+                })
         
         # additional_kwargsを更新
-        if file_content_description and file_content_description != "ファイルなし":
-            user_message.additional_kwargs["file_content"] = file_content_description
-        if combined_understanding and combined_understanding != "ファイルなし":
-            user_message.additional_kwargs["understanding"] = combined_understanding
-        
-        # 更新するstateの基本部分
-        if skip_human_message:
-            # ツール/関数メッセージの後の場合はHumanMessageを追加しない
-            updated_state = {
-                **state,  # 既存の状態を維持
-                "input_text": input_text,
-                "files": processed_files,  # blobデータを除去し、説明を含めたファイル情報
-                "processed_input": combined_understanding,  # 処理された入力
-                "success": True,  # 処理が成功したことを示すフラグを設定
-            }
-        else:
-            updated_state = {
-                **state,  # 既存の状態を維持
-                "input_text": input_text,
-                "files": processed_files,  # blobデータを除去し、説明を含めたファイル情報
-                "processed_input": combined_understanding,  # 処理された入力
-                "messages": state.get("messages", []) + [user_message],  # HumanMessageオブジェクトを追加
-                "success": True,  # 処理が成功したことを示すフラグを設定
-            }
+        if user_message is not None:
+            if file_content_description and file_content_description != "ファイルなし":
+                user_message.additional_kwargs["file_content"] = file_content_description
+            if combined_understanding and combined_understanding != "ファイルなし":
+                user_message.additional_kwargs["understanding"] = combined_understanding
+        
+        # 更新するstateの差分（元のstateとの合成はLangGraphが行う）
+        # メッセージはadded_messagesに追加する（ツール/関数メッセージの後の場合はHumanMessageを含まない）
+        delta = {
+            "input_text": input_text,
+            "files": processed_files,  # blobデータを除去し、説明を含めたファイル情報
+            "processed_input": combined_understanding,  # 処理された入力
+            "success": True,  # 処理が成功したことを示すフラグを設定
+        }
         
         if requires_tool:
             # ツールが必要な場合
@@ -738,25 +761,21 @@ def process_unified_response(state: Dict[str, Any], input_text: str, files_data:
             # 指定されたツールが利用可能かチェック
             if tool_name in available_nodes:
                 next_node = tool_name
-                print(f"次のノード: {tool_name} ({available_nodes[tool_name].get('description', '説明なし')})")
+                logger.debug("次のノード: %s (%s)", tool_name, available_nodes[tool_name].get('description', '説明なし'))
                 
                 # SystemMessageオブジェクトを作成（次のノードでの行動を記載）
                 system_message = SystemMessage(
                     content=reasoning,
                     additional_kwargs={
-                        "node_info": {
-                            "node_name": "unified_response_node",  # ノード名
-                            "node_type": "internal",
-                            "timestamp": datetime.now().isoformat(),
-                        },
+                        "node_info": make_node_info(*_INTERNAL_NODE_INFO_STATIC, _ts),
                         "action": tool_name,
                         "reasoning": reasoning
                     }
                 )
                 
                 # Stateに情報を追加
-                updated_state["messages"] = updated_state["messages"] + [system_message]  # SystemMessageを追加
-                updated_state["next_node"] = next_node  # 次のノード名を追加
+                added_messages.append(system_message)  # SystemMessageを追加
+                delta["next_node"] = next_node  # 次のノード名を追加
             else:
                 # 指定されたツールが利用できない場合はデフォルトの応答を生成
                 print(f"ツール '{tool_name}' は利用できません。直接応答を生成します。")
@@ -773,18 +792,14 @@ def process_unified_response(state: Dict[str, Any], input_text: str, files_data:
                 ai_message = AIMessage(
                     content=response_text,
                     additional_kwargs={
-                        "node_info": {
-                            "node_name": "unified_response_node",  # ノード名
-                            "node_type": "user_facing",
-                            "timestamp": datetime.now().isoformat(),
-                        }
+                        "node_info": make_node_info(*_USER_FACING_NODE_INFO_STATIC, _ts)
                     }
                 )
                 
                 # Stateに応答情報を追加
-                updated_state["messages"] = updated_state["messages"] + [ai_message]  # AIMessageを追加
-                updated_state["response"] = response_text  # 応答テキストを追加
-                updated_state["next_node"] = "end"  # 次のノードとして終了ノードを指定
+                added_messages.append(ai_message)  # AIMessageを追加
+                delta["response"] = response_text  # 応答テキストを追加
+                delta["next_node"] = "end"  # 次のノードとして終了ノードを指定
         else:
             # ツールが不要な場合は直接応答を生成
             # responseフィールドがない場合はcontentフィールドを使用
@@ -800,30 +815,27 @@ def process_unified_response(state: Dict[str, Any], input_text: str, files_data:
             ai_message = AIMessage(
                 content=response_text if response_text else "エラー: 応答テキストが空です",
                 additional_kwargs={
-                    "node_info": {
-                        "node_name": "unified_response_node",  # ノード名
-                        "node_type": "user_facing",
-                        "timestamp": datetime.now().isoformat(),
-                    },
+                    "node_info": make_node_info(*_USER_FACING_NODE_INFO_STATIC, _ts),
                     "error": "応答テキストが空です" if not response_text else None
                 }
             )
             
-            # Stateに情報を追加（既存のupdated_stateを使用）
-            updated_state["messages"] = updated_state["messages"] + [ai_message]  # AIMessageを追加
-            updated_state["response"] = response_text  # 応答テキストを追加
-            updated_state["next_node"] = "end"  # 次のノードとして終了ノードを指定
+            # Stateに情報を追加
+            added_messages.append(ai_message)  # AIMessageを追加
+            delta["response"] = response_text  # 応答テキストを追加
+            delta["next_node"] = "end"  # 次のノードとして終了ノードを指定
             
             # response_textが空の場合は処理失敗とみなす
             if not response_text:
-                updated_state["success"] = False
-                updated_state["error"] = "応答テキストが空です"
+                delta["success"] = False
+                delta["error"] = "応答テキストが空です"
                 print("エラー: 応答テキストが空のため、処理を失敗とみなします。")
         
         # inactivity_timeoutをstateに追加
-        updated_state["inactivity_timeout"] = inactivity_timeout
+        delta["inactivity_timeout"] = inactivity_timeout
         
-        return updated_state
+        delta["messages"] = added_messages
+        return delta
     except Exception as e:
         print(f"統合ノードエラー: {str(e)}")
         # エラーが発生した場合はデフォルト値を設定
@@ -834,25 +846,18 @@ def process_unified_response(state: Dict[str, Any], input_text: str, files_data:
         ai_message = AIMessage(
             content="ごめんなさい、エラーが発生しました。もう一度お願いできますか？",
             additional_kwargs={
-                "node_info": {
-                    "node_name": "unified_response_node",  # ノード名
-                    "node_type": "user_facing",
-                    "timestamp": datetime.now().isoformat(),
-                },
+                "node_info": make_node_info(*_USER_FACING_NODE_INFO_STATIC),
                 "error": str(e)
             }
         )
         
-        # Stateに情報を追加（エラー情報を含む）
-        updated_state = {
-            **state,  # 既存の状態を維持
+        # 更新するstateの差分（エラー情報を含む。元のstateとの合成はLangGraphが行う）
+        return {
             "input_text": input_text,
             "files": [],  # エラー時は空のリスト
             "processed_input": "入力情報の処理に失敗しました",
-            "messages": state.get("messages", []) + [ai_message],  # メッセージを追加
+            "messages": [ai_message],  # このノードで追加したメッセージのみ
             "success": False,  # 処理が失敗したことを示すフラグを設定
             "response": "ごめんなさい、エラーが発生しました。もう一度お願いできますか？",
             "next_node": "end"  # エラー時は終了ノードを指定
         }
-        
-        return updated_state
@@ -1,10 +1,48 @@
 from typing import Dict, List, Any
 from datetime import datetime
 import random
-import uuid  # 一意のIDを生成するためのモジュール
+import re
+import itertools
+import secrets
+from utils.message_utils import make_node_info
 from nodes.registry import register_node
 from langchain.schema.messages import ToolMessage  # 正しいインポートパス
 
+# このノードが作成するメッセージのノード情報（ノード名, ノードタイプ）
+_WEATHER_NODE_INFO_STATIC = ("weather_search_node", "service")
+
+# tool_call_idの生成に使うプロセスごとのトークンと連番
+# uuid4を使わずに、プロセス内で一意かつログで読みやすいIDを作る
+_NODE_TOKEN = secrets.token_hex(4)
+_COUNTER = itertools.count()
+
+# 抽出対象の都市名（簡易版）
+_CITIES = ("東京", "大阪", "名古屋", "福岡", "札幌", "仙台", "広島", "京都")
+
+# 本文から都市名を一度の走査で見つけるための検索器
+# pyahocorasickがインストールされている場合はAho-Corasickのオートマトン、ない場合は正規表現の選択を使用する
+try:
+    import ahocorasick
+
+    _CITY_AUTOMATON = ahocorasick.Automaton()
+    for _city in _CITIES:
+        _CITY_AUTOMATON.add_word(_city, _city)
+    _CITY_AUTOMATON.make_automaton()
+
+    def _find_city(content):
+        for _, city in _CITY_AUTOMATON.iter(content):
+            return city
+        return None
+except ImportError:
+    _CITY_RE = re.compile("|".join(map(re.escape, _CITIES)))
+
+    def _find_city(content):
+        match = _CITY_RE.search(content)
+        return match.group(0) if match else None
+
+# モックの天気の種類
+_WEATHER_TYPES = ("晴れ", "曇り", "雨", "雪", "晴れ時々曇り", "曇り時々雨", "雨時々晴れ")
+
 @register_node(
     name="weather_search",
     description="都市名から天気情報を検索するノード（モック版）",
@@ -22,6 +60,9 @@ def process_weather_search(state: Dict[str, Any]) -> Dict[str, Any]:
     Returns:
         Dict[str, Any]: 更新された状態
     """
+    # タイムスタンプは成功時・エラー時ともにこの時刻を使う
+    _ts = datetime.now().isoformat()
+    
     try:
         # 状態から情報を取得
         messages = state.get("messages", [])
@@ -42,13 +83,9 @@ def process_weather_search(state: Dict[str, Any]) -> Dict[str, Any]:
         weather_message = ToolMessage(
             name="weather_search",
             content=weather_info,
-            tool_call_id=f"weather_search_{uuid.uuid4()}",  # 一意のIDを生成
+            tool_call_id=f"weather_search_{_NODE_TOKEN}_{next(_COUNTER)}",  # 一意のIDを生成
             additional_kwargs={
-                "node_info": {
-                    "node_name": "weather_search_node",
-                    "node_type": "service",
-                    "timestamp": datetime.now().isoformat(),
-                },
+                "node_info": make_node_info(*_WEATHER_NODE_INFO_STATIC, _ts),
                 "weather_info": {
                     "city": city_name,
                     "today": today_weather,
@@ -77,13 +114,9 @@ def process_weather_search(state: Dict[str, Any]) -> Dict[str, Any]:
         error_message_obj = ToolMessage(
             name="weather_search",
             content=error_message,
-            tool_call_id=f"weather_search_error_{uuid.uuid4()}",  # 一意のIDを生成
+            tool_call_id=f"weather_search_error_{_NODE_TOKEN}_{next(_COUNTER)}",  # 一意のIDを生成
             additional_kwargs={
-                "node_info": {
-                    "node_name": "weather_search_node",
-                    "node_type": "service",
-                    "timestamp": datetime.now().isoformat(),
-                },
+                "node_info": make_node_info(*_WEATHER_NODE_INFO_STATIC, _ts),
                 "error": str(e)
             }
         )
@@ -105,15 +138,11 @@ def extract_city_name(messages):
     メッセージから都市名を抽出する関数（簡易版）
     """
     # 簡易的な都市名抽出
-    cities = ["東京", "大阪", "名古屋", "福岡", "札幌", "仙台", "広島", "京都"]
-    
-    for i in range(len(messages) - 1, -1, -1):
-        msg = messages[i]
-        if hasattr(msg, 'type') and msg.type == "human":
-            content = msg.content
-            for city in cities:
-                if city in content:
-                    return city
+    for msg in reversed(messages):
+        if getattr(msg, 'type', None) == "human":
+            city = _find_city(str(msg.content))
+            if city:
+                return city
     
     return "東京"  # デフォルト値
 
@@ -121,12 +150,8 @@ def generate_mock_weather():
     """
     ランダムな天気情報を生成する関数
     """
-    weather_types = ["晴れ", "曇り", "雨", "雪", "晴れ時々曇り", "曇り時々雨", "雨時々晴れ"]
-    temperatures = list(range(0, 35))  # 0℃から35℃
-    humidity_values = list(range(30, 90))  # 30%から90%
-    
-    weather = random.choice(weather_types)
-    temp = random.choice(temperatures)
-    humidity = random.choice(humidity_values)
+    weather = _WEATHER_TYPES[random.randrange(len(_WEATHER_TYPES))]
+    temp = random.randrange(35)  # 0℃から34℃
+    humidity = random.randrange(30, 90)  # 30%から89%
     
     return f"天気: {weather}, 気温: {temp}°C, 湿度: {humidity}%"
@@ -1,9 +1,12 @@
 """
 API通信のログを記録するユーティリティモジュール
 """
+import atexit
 import json
 import os
+import queue
 import sys
+import threading
 from datetime import datetime
 from pathlib import Path
 from typing import Dict, Optional, Any
@@ -11,9 +14,100 @@ from typing import Dict, Optional, Any
 # PathConfigクラスのインポート
 from utils.path_config import PathConfig
 
+# デバッグ用に、環境変数MIKU_API_LOG_INDENTが設定されている場合はJSONをインデントして書き込む
+_INDENT = bool(os.environ.get("MIKU_API_LOG_INDENT"))
+
+# orjsonがインストールされている場合はそちらでシリアライズする（標準のjsonより高速）
+# どちらの場合もUTF-8のバイト列を返し、JSONシリアライズできない値はstrに変換する
+try:
+    import orjson
+
+    _ORJSON_OPTION = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if _INDENT else 0)
+
+    def _dumps(obj) -> bytes:
+        return orjson.dumps(obj, default=str, option=_ORJSON_OPTION)
+except ImportError:
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, default=str, indent=2 if _INDENT else None).encode("utf-8")
+
+# 書き込み待ちのログ（(ログファイルのパス, シリアライズ済みのログの各部分)のタプル）
+# save_api_logはシリアライズしてキューに追加するだけで戻り、バックグラウンドのスレッドがファイルに書き込む
+_log_queue = queue.Queue()
+
+# ログを書き込むバックグラウンドのスレッド（最初のsave_api_log呼び出し時に起動）
+_writer_thread = None
+_writer_lock = threading.Lock()
+
+# os.writevが使える環境（Windows以外）では、ログの各部分を連結せずに1回のシステムコールで書き込む
+_HAS_WRITEV = hasattr(os, "writev")
+_OPEN_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0)
+
+def _serialize_log(url, headers, request_data, response_json) -> tuple:
+    """ログ1件をファイルに書き込むバイト列の各部分にシリアライズする関数"""
+    return (
+        b"=== API Request ===\nURL: ", str(url).encode("utf-8"),
+        b"\nHeaders: ", _dumps(headers),
+        b"\nData: ", _dumps(request_data),
+        b"\n==================\n\n=== API Response ===\n", _dumps(response_json),
+        b"\n===================\n",
+    )
+
+def _write_log_file(log_file, parts):
+    """シリアライズ済みのログ1件をファイルに書き込む関数（すべての部分を一度の書き込みで書き込む）"""
+    if _HAS_WRITEV:
+        fd = os.open(log_file, _OPEN_FLAGS, 0o644)
+        try:
+            total = sum(map(len, parts))
+            written = os.writev(fd, parts)
+            if written < total:
+                # 一度で書き切れなかった場合は残りをまとめて書き込む
+                rest = memoryview(b"".join(parts))[written:]
+                while rest:
+                    rest = rest[os.write(fd, rest):]
+        finally:
+            os.close(fd)
+    else:
+        with open(log_file, 'wb', buffering=65536) as f:
+            f.write(b"".join(parts))
+
+def _writer_loop():
+    """キューからログを取り出してファイルに書き込み続ける関数（バックグラウンドのスレッドで実行）"""
+    while True:
+        record = _log_queue.get()
+        try:
+            ApiLogger._ensure_dir(os.path.dirname(record[0]))
+            _write_log_file(*record)
+        except Exception as e:
+            print(f"APIログの保存に失敗しました: {str(e)}")
+        finally:
+            _log_queue.task_done()
+
+def _ensure_writer():
+    """ログを書き込むバックグラウンドのスレッドを起動する関数（起動済みの場合は何もしない）"""
+    global _writer_thread
+    if _writer_thread is not None:
+        return
+    with _writer_lock:
+        if _writer_thread is None:
+            _writer_thread = threading.Thread(target=_writer_loop, name="api-log-writer", daemon=True)
+            _writer_thread.start()
+
 class ApiLogger:
     """APIリクエストとレスポンスをログに記録するクラス"""
     
+    # APIログを記録するかどうか（環境変数MIKU_API_LOG=0で無効化）
+    enabled = os.environ.get("MIKU_API_LOG", "1") != "0"
+    
+    # 作成済み（存在を確認済み）のログディレクトリ
+    _seen_dirs = set()
+    
+    @staticmethod
+    def _ensure_dir(log_dir) -> None:
+        """ログディレクトリを作成する（プロセス内でディレクトリごとに一度だけ行う）"""
+        if log_dir not in ApiLogger._seen_dirs:
+            os.makedirs(log_dir, exist_ok=True)
+            ApiLogger._seen_dirs.add(log_dir)
+    
     @staticmethod
     def get_timestamp() -> str:
         """現在のタイムスタンプを取得"""
@@ -40,8 +134,17 @@ class ApiLogger:
             api_name: API名（ログファイル名のプレフィックス）
             
         Returns:
-            ログファイルのパス（保存に失敗した場合はNone）
+            ログファイルのパス（ログが無効な場合、ログディレクトリを取得できなかった場合はNone）
+            
+        Note:
+            ファイルへの書き込みはバックグラウンドのスレッドで行われるため、
+            この関数から戻った時点ではファイルがまだ作成されていない場合がある
+            （書き込みの完了を待つ場合はflushを呼び出す）
         """
+        # ログが無効な場合は何もしない
+        if not ApiLogger.enabled:
+            return None
+        
         try:
             # シングルトンインスタンスを取得
             path_config = PathConfig.get_instance()
@@ -58,27 +161,22 @@ class ApiLogger:
         # ログファイルのパスを作成
         log_file = path_config.api_logs_dir / f'{timestamp}_log_{api_name}.txt'
         
+        # シリアライズはこの時点で行い、呼び出し元がこの後でrequest_dataなどを変更してもログの内容が変わらないようにする
+        # ファイルへの書き込みのみバックグラウンドのスレッドで行い、呼び出し元はすぐに戻る
         try:
-            # ディレクトリが存在することを確認
-            log_dir = os.path.dirname(log_file)
-            # print(f"ログディレクトリを作成: {log_dir}")
-            os.makedirs(log_dir, exist_ok=True)
-            
-            # print(f"APIログファイルに書き込み: {log_file}")
-            with open(log_file, 'w', encoding='utf-8') as f:
-                f.write("=== API Request ===\n")
-                f.write(f"URL: {url}\n")
-                f.write(f"Headers: {json.dumps(headers, ensure_ascii=False, indent=2)}\n")
-                f.write(f"Data: {json.dumps(request_data, ensure_ascii=False, indent=2)}\n")
-                f.write("==================\n\n")
-                
-                f.write("=== API Response ===\n")
-                f.write(json.dumps(response_json, ensure_ascii=False, indent=2))
-                f.write("\n===================\n")
-            
-            # print(f"APIログを保存しました: {log_file}")
-            return log_file
-            
+            parts = _serialize_log(url, headers, request_data, response_json)
         except Exception as e:
             print(f"APIログの保存に失敗しました: {str(e)}")
             return None
+        _ensure_writer()
+        _log_queue.put_nowait((log_file, parts))
+        return log_file
+    
+    @staticmethod
+    def flush() -> None:
+        """書き込み待ちのログがすべてファイルに書き込まれるまで待つ"""
+        if _writer_thread is not None:
+            _log_queue.join()
+
+# 終了時に書き込み待ちのログを書き込む
+atexit.register(ApiLogger.flush)
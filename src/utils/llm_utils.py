@@ -2,18 +2,41 @@
 LLM呼び出しに関するユーティリティモジュール
 LangChainとLangGraphを使用してLLM呼び出しを実装
 """
-from typing import Dict, List, Any, Optional, Union
+from typing import Dict, List, Any, Optional, Tuple, Union
 import json
 import base64
 import re
+import asyncio
+from functools import lru_cache
 from utils.api_logger import ApiLogger
 from utils.path_config import PathConfig
+from utils.message_utils import extract_conversation_history
 from models.config_manager import ConfigManager
 
 # LangChainとLangGraphのインポート
 from langchain_openai import ChatOpenAI
 from langchain.schema import HumanMessage, SystemMessage, AIMessage
 
+# 高速なJSONパーサがインストールされている場合はそちらを使用する（jiter → orjson → 標準のjsonの順）
+# どのパーサでも、パースに失敗した場合はjson.JSONDecodeErrorを発生させる
+try:
+    import jiter
+
+    def _json_loads(text: str) -> Any:
+        try:
+            # cache_mode="keys"で、毎回同じキー（input_processingなど）の文字列を使い回す
+            return jiter.from_json(text.encode("utf-8"), cache_mode="keys")
+        except ValueError as e:
+            raise json.JSONDecodeError(str(e), text, 0)
+except ImportError:
+    try:
+        import orjson
+
+        # orjson.JSONDecodeErrorはjson.JSONDecodeErrorのサブクラス
+        _json_loads = orjson.loads
+    except ImportError:
+        _json_loads = json.loads
+
 def validate_schema(data, schema, path=""):
     """JSONデータがスキーマに従っているかを検証する関数"""
     errors = []
@@ -46,6 +69,32 @@ def validate_schema(data, schema, path=""):
     
     return errors
 
+# マークダウンのコードブロック内のJSON（オブジェクトまたは配列）
+_CODE_BLOCK_RE = re.compile(r'```(?:json)?\s*(\{[\s\S]*?\}|\[[\s\S]*?\])\s*```')
+# 文章中に埋め込まれたJSONの開始位置の候補
+_JSON_START_RE = re.compile(r'[\{\[]')
+# 開始位置からJSONを1つだけ読み取るためのデコーダ（raw_decodeは読み終えた位置を返し、後続のテキストを無視する）
+_DECODER = json.JSONDecoder()
+# 個別のコードブロックに書かれたJSONオブジェクト（parse_json_response_batchで使用）
+_CODE_BLOCK_OBJECT_RE = re.compile(r'```(?:json)?\s*(\{[\s\S]*?\})\s*```')
+
+# パース結果をスキーマで検証する関数
+def _check_schema(result: Any, expected_schema: Optional[Dict[str, Any]], default_values: Optional[Dict[str, Any]]) -> Any:
+    """
+    パース結果がスキーマに従っているかを検証し、従っていればそのまま返す関数
+    
+    Raises:
+        ValueError: スキーマ検証に失敗し、デフォルト値も指定されていない場合
+    """
+    if expected_schema and isinstance(result, dict):
+        validation_errors = validate_schema(result, expected_schema)
+        if validation_errors:
+            print(f"スキーマ検証エラー: {validation_errors}")
+            if default_values:
+                return default_values
+            raise ValueError(f"スキーマ検証エラー: {validation_errors}")
+    return result
+
 def parse_json_response(content: str, default_values: Optional[Dict[str, Any]] = None, expected_schema: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     """
     LLMのレスポンスからJSONを抽出する関数
@@ -68,213 +117,135 @@ def parse_json_response(content: str, default_values: Optional[Dict[str, Any]] =
     # print(f"入力タイプ: {type(content)}")
     # print("================================\n")
     
+    # JSONモードのLLMはJSONのみを返すことが多いため、まずは正規表現を使わずに全体をパース
+    try:
+        result = _json_loads(content)
+    except json.JSONDecodeError as e:
+        content_error = e
+    else:
+        return _check_schema(result, expected_schema, default_values)
+    
     # マークダウンのコードブロックを処理
-    code_block_match = re.search(r'```(?:json)?\s*([\s\S]*?)\s*```', content)
+    code_block_match = _CODE_BLOCK_RE.search(content)
     if code_block_match:
-        json_str = code_block_match.group(1).strip()
+        json_str = code_block_match.group(1)
         # print(f"コードブロック抽出: {json_str}")
         try:
-            result = json.loads(json_str)
-            # print(f"コードブロックからJSONを抽出しました: {result}")
-            # print(f"結果タイプ: {type(result)}")
-            
-            # スキーマ検証
-            if expected_schema and isinstance(result, dict):
-                validation_errors = validate_schema(result, expected_schema)
-                if validation_errors:
-                    print(f"スキーマ検証エラー: {validation_errors}")
-                    if default_values:
-                        return default_values
-                    raise ValueError(f"スキーマ検証エラー: {validation_errors}")
-            
-            return result
+            result = _json_loads(json_str)
         except json.JSONDecodeError:
-            # JSONパースエラーを再スロー（キャッチしない）
-            print(f"コードブロックのJSONパースに失敗")
             # 失敗した場合は次の方法を試す
+            print(f"コードブロックのJSONパースに失敗")
+        else:
+            return _check_schema(result, expected_schema, default_values)
     
-    # JSONブロックを抽出
-    json_match = re.search(r'\{.*\}', content, re.DOTALL)
-    if json_match:
-        json_str = json_match.group(0)
-        # print(f"JSONブロック抽出: {json_str}")
+    # 文章中に埋め込まれたJSONを抽出（「{」または「[」の位置から前方に一度だけ読み進める）
+    for start_match in _JSON_START_RE.finditer(content):
         try:
-            result = json.loads(json_str)
-            # print(f"JSONブロックを抽出しました: {result}")
-            # print(f"結果タイプ: {type(result)}")
-            
-            # スキーマ検証を追加
-            if expected_schema and isinstance(result, dict):
-                validation_errors = validate_schema(result, expected_schema)
-                if validation_errors:
-                    print(f"スキーマ検証エラー: {validation_errors}")
-                    if default_values:
-                        return default_values
-                    raise ValueError(f"スキーマ検証エラー: {validation_errors}")
-            
-            return result
+            result, _ = _DECODER.raw_decode(content, start_match.start())
         except json.JSONDecodeError:
-            # JSONパースエラーを再スロー（キャッチしない）
-            print(f"JSONブロックのパースに失敗")
-            # 失敗した場合は次の方法を試す
+            continue
+        return _check_schema(result, expected_schema, default_values)
     
-    # JSONブロックが見つからない場合は全体をパース
-    try:
-        # print("コンテンツ全体をJSONとしてパース試行")
-        result = json.loads(content)
-        # print(f"コンテンツ全体をJSONとしてパースしました: {result}")
-        # print(f"結果タイプ: {type(result)}")
+    # すべての方法で失敗した場合は、デフォルト値を返すか全体のパースエラーを再スロー
+    if default_values:
+        print(f"デフォルト値を返します: {default_values}")
+        return default_values
+    print(f"JSONパースエラー: すべての方法でJSONパースに失敗しました")
+    raise content_error
+
+class LLMSetupError(Exception):
+    """LLMの初期化（APIキーの未設定、未対応のプロバイダなど）に関するエラーを表すカスタム例外クラス"""
+    pass
+
+# 設定マネージャを取得する関数（初回のみ作成し、以降はキャッシュを返す）
+@lru_cache(maxsize=1)
+def _get_config_manager() -> ConfigManager:
+    path_config = PathConfig.get_instance()
+    return ConfigManager.get_instance(path_config.settings_file)
+
+# API設定を取得する関数（初回のみ取得し、以降はキャッシュを返す）
+@lru_cache(maxsize=1)
+def _get_api_settings() -> Dict[str, Any]:
+    return _get_config_manager().get_api_settings()
+
+# 使用するLLMプロバイダを決定する関数
+def _resolve_provider(llm_provider: str) -> str:
+    """
+    使用するLLMプロバイダを決定する関数（明示的に指定されていない場合は設定ファイルのデフォルトを使用）
+    
+    Args:
+        llm_provider (str): 呼び出し元が指定したLLMプロバイダ（空文字列の場合はデフォルト）
         
-        # スキーマ検証を追加
-        if expected_schema and isinstance(result, dict):
-            validation_errors = validate_schema(result, expected_schema)
-            if validation_errors:
-                print(f"スキーマ検証エラー: {validation_errors}")
-                if default_values:
-                    return default_values
-                raise ValueError(f"スキーマ検証エラー: {validation_errors}")
-        
-        return result
-    except json.JSONDecodeError:
-        # JSONパースエラーを再スロー（キャッチしない）
-        if default_values:
-            print(f"デフォルト値を返します: {default_values}")
-            return default_values
-        print(f"JSONパースエラー: すべての方法でJSONパースに失敗しました")
-        raise
+    Returns:
+        str: LLMプロバイダ名
+    """
+    if llm_provider:
+        return llm_provider
+    default_provider = _get_config_manager().get_default_llm_provider()
+    print(f"デフォルトのLLMプロバイダを使用: {default_provider}")
+    return default_provider
 
-def call_llm(
-    state: Dict[str, Any],
-    system_prompt: Optional[List[str]] = None,
-    files_data: Optional[List[Dict[str, Any]]] = None,
-    api_name: str = "",  # 呼び出し元を識別するためのAPI名
-    llm_provider: str = "",  # デフォルトはなし。openrouter、geminiが選択可能
-    expected_schema: Optional[Dict[str, Any]] = None  # 期待するJSONスキーマ
-) -> Dict[str, Any]:
+# LangChainのチャットモデルを作成する関数
+# 同じ設定のクライアントは使い回し、並行して呼び出す場合もHTTPの接続プールを共有する
+@lru_cache(maxsize=8)
+def _get_llm(provider: str, model: str, api_key: str, api_url: str):
     """
-    LangChainを使用してLLMを呼び出す関数
+    LangChainのチャットモデルを作成する関数（引数ごとにキャッシュされる）
     
     Args:
-        state (Dict[str, Any]): 現在の状態（messagesを含む）
-        system_prompt (List[str], optional): システムプロンプトのリスト
-        files_data (List[Dict[str, Any]], optional): 添付ファイルのデータリスト
-        api_name (str, optional): APIログに記録する呼び出し元の名前
-        llm_provider (str, optional): 使用するLLMプロバイダ（"openrouter"または"gemini"）
-        expected_schema (Dict[str, Any], optional): 期待するJSONスキーマ
+        provider (str): LLMプロバイダ名（"openrouter"または"gemini"）
+        model (str): モデル名
+        api_key (str): APIキー
+        api_url (str): APIのURL（OpenRouterのみ使用）
         
     Returns:
-        Dict[str, Any]: 処理結果（JSONパース済みの辞書オブジェクト）
+        LangChainのチャットモデル
         
-    Note:
-        この関数は内部でparse_json_responseを呼び出し、LLMからの応答を
-        JSONとしてパースした結果を返します。返り値はすでにパース済みの
-        辞書オブジェクトであるため、呼び出し元で再度parse_json_responseを
-        呼び出す必要はありません。
+    Raises:
+        ImportError: Geminiを使用する場合に、langchain-google-genaiがインストールされていない場合
     """
-    # 設定を読み込み
-    path_config = PathConfig.get_instance()
-    config_manager = ConfigManager(path_config.settings_file)
-    api_settings = config_manager.get_api_settings()
-    
-    # メッセージの準備
-    messages = []
-    
-    # システムプロンプトがある場合は追加
-    if system_prompt:
-        for prompt in system_prompt:
-            messages.append(SystemMessage(content=prompt))
-    
-    # stateからメッセージを取得
-    state_messages = state.get("messages", [])
+    if provider == "gemini":
+        # LangChain-Google-GenAIをインポート（インストールされていない場合はImportError）
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        
+        return ChatGoogleGenerativeAI(
+            model=model,
+            google_api_key=api_key,
+            convert_system_message_to_human=True  # Geminiはシステムメッセージを直接サポートしていないため
+        )
+    return ChatOpenAI(
+        model=model,
+        openai_api_key=api_key,
+        openai_api_base=api_url
+    )
+
+def invalidate_llm_cache() -> None:
+    """
+    キャッシュされている設定とLLMクライアントを破棄する関数
     
-    # stateのメッセージを適切なLangChainメッセージに変換
-    for msg in state_messages:
-        if hasattr(msg, 'type') and hasattr(msg, 'content'):
-            if msg.type == "human":
-                # 画像データがある場合はマルチモーダル処理
-                if files_data and msg == state_messages[-1]:  # 最新のメッセージの場合のみ
-                    content_parts = []
-                    content_parts.append({"type": "text", "text": msg.content})
-                    
-                    for file_data in files_data:
-                        if file_data.get("type") == "画像" and file_data.get("content"):
-                            try:
-                                # 画像データをBase64エンコード
-                                image_content = file_data.get("content", b"")
-                                image_b64 = base64.b64encode(image_content).decode('utf-8')
-                                
-                                # 画像のMIMEタイプを取得
-                                mime_type = file_data.get("content_type")
-                                
-                                # 画像データを追加
-                                content_parts.append({
-                                    "type": "image_url",
-                                    "image_url": {
-                                        "url": f"data:{mime_type};base64,{image_b64}"
-                                    }
-                                })
-                                # print(f"画像データを追加: {file_data.get('filename')} ({len(image_b64)} バイト)")
-                            except Exception as img_error:
-                                print(f"画像データの処理エラー: {str(img_error)}")
-                    
-                    if len(content_parts) > 1:
-                        human_msg = HumanMessage(content=content_parts)
-                        if hasattr(msg, 'additional_kwargs'):
-                            human_msg.additional_kwargs = msg.additional_kwargs
-                        messages.append(human_msg)
-                    else:
-                        human_msg = HumanMessage(content=msg.content)
-                        if hasattr(msg, 'additional_kwargs'):
-                            human_msg.additional_kwargs = msg.additional_kwargs
-                        messages.append(human_msg)
-                else:
-                    human_msg = HumanMessage(content=msg.content)
-                    if hasattr(msg, 'additional_kwargs'):
-                        human_msg.additional_kwargs = msg.additional_kwargs
-                        # print("human_msgに追加しました")
-                        # print("human_msg",human_msg)
-                    messages.append(human_msg)
-            elif msg.type == "ai":
-                ai_msg = AIMessage(content=msg.content)
-                if hasattr(msg, 'additional_kwargs'):
-                    ai_msg.additional_kwargs = msg.additional_kwargs
-                messages.append(ai_msg)
-            elif msg.type == "system":
-                system_msg = SystemMessage(content=msg.content)
-                if hasattr(msg, 'additional_kwargs'):
-                    system_msg.additional_kwargs = msg.additional_kwargs
-                messages.append(system_msg)
-            elif msg.type == "function" or msg.type == "tool":
-                # ツール名を取得
-                name = getattr(msg, 'name', '不明なツール')
-                
+    設定ファイルを変更した場合やテストで、次回の呼び出し時に設定を読み込み直させるために使用する
+    """
+    _get_config_manager.cache_clear()
+    _get_api_settings.cache_clear()
+    _get_llm.cache_clear()
 
-                use_gemini = True  # geminiを使う場合はtrue。geminiはrokeにtoolを許容していないため
-                # Gemini使用時はtoolメッセージをsystemメッセージに変換
-                if use_gemini:
-                    # ツールメッセージをシステムメッセージに変換
-                    formatted_content = f"ツール「{name}」の結果:\n{msg.content}"
-                    system_msg = SystemMessage(content=formatted_content)
-                    if hasattr(msg, 'additional_kwargs'):
-                        system_msg.additional_kwargs = msg.additional_kwargs
-                    messages.append(system_msg)
-                    # print(f"ツールメッセージをシステムメッセージに変換: {name}")
-                else:
-                    # OpenAIなど他のLLMではFunctionMessageをそのまま使用
-                    from langchain.schema import FunctionMessage
-                    function_msg = FunctionMessage(name=name, content=msg.content)
-                    if hasattr(msg, 'additional_kwargs'):
-                        function_msg.additional_kwargs = msg.additional_kwargs
-                    messages.append(function_msg)
-    
-    # デフォルトのプロバイダを取得（明示的に指定されていない場合）
-    default_provider = ""
-    if not llm_provider:
-        default_provider = config_manager.get_default_llm_provider()
-        print(f"デフォルトのLLMプロバイダを使用: {default_provider}")
+# LLMを初期化する関数
+def _create_llm(provider: str, api_settings: Dict[str, Any]):
+    """
+    LLMプロバイダに応じてLangChainのチャットモデルを初期化する関数
     
+    Args:
+        provider (str): LLMプロバイダ名（"openrouter"または"gemini"）
+        api_settings (Dict[str, Any]): 設定ファイルのAPI設定
+        
+    Returns:
+        Tuple[Any, str]: チャットモデルと、APIログに記録するAPIのURL
+        
+    Raises:
+        LLMSetupError: APIキーが設定されていない場合、必要なパッケージがない場合、未対応のプロバイダの場合
+    """
     # LLMプロバイダに応じて処理を分岐
-    if llm_provider == "openrouter" or (not llm_provider and default_provider == "openrouter"):
+    if provider == "openrouter":
         # OpenRouter APIの設定
         openrouter_config = api_settings.get("openrouter", {})
         api_url = "https://openrouter.ai/api/v1"
@@ -283,16 +254,12 @@ def call_llm(
         
         if not api_key:
             print("警告: OpenRouter APIキーが設定されていません。")
-            return {"error": "APIキーが設定されていません"}
+            raise LLMSetupError("APIキーが設定されていません")
         
-        # OpenRouterのLLMを初期化
-        llm = ChatOpenAI(
-            model=model,
-            openai_api_key=api_key,
-            openai_api_base=api_url
-        )
+        # OpenRouterのLLMを初期化（キャッシュ済みであれば使い回す）
+        return _get_llm(provider, model, api_key, api_url), api_url
     
-    elif llm_provider == "gemini" or (not llm_provider and default_provider == "gemini"):
+    elif provider == "gemini":
         # Gemini APIの設定
         gemini_config = api_settings.get("gemini", {})
         api_key = gemini_config.get("api_key", "")
@@ -300,105 +267,504 @@ def call_llm(
         
         if not api_key:
             print("警告: Gemini APIキーが設定されていません。")
-            return {"error": "APIキーが設定されていません"}
+            raise LLMSetupError("APIキーが設定されていません")
         
-        # Gemini APIの初期化
+        # GeminiのLLMを初期化（キャッシュ済みであれば使い回す）
+        api_url = "https://generativelanguage.googleapis.com"
         try:
-            # LangChain-Google-GenAIをインポート（インストールされていない場合はエラーメッセージを表示）
-            from langchain_google_genai import ChatGoogleGenerativeAI
-            
-            # GeminiのLLMを初期化
-            llm = ChatGoogleGenerativeAI(
-                model=model,
-                google_api_key=api_key,
-                convert_system_message_to_human=True  # Geminiはシステムメッセージを直接サポートしていないため
-            )
+            llm = _get_llm(provider, model, api_key, api_url)
         except ImportError:
             print("警告: langchain-google-genaiがインストールされていません。")
-            return {"error": "Geminiを使用するには、'pip install langchain-google-genai google-generativeai'を実行してください。"}
+            raise LLMSetupError("Geminiを使用するには、'pip install langchain-google-genai google-generativeai'を実行してください。")
+        return llm, api_url
+    
+    print(f"警告: サポートされていないLLMプロバイダです: {provider}")
+    raise LLMSetupError(f"サポートされていないLLMプロバイダです: {provider}")
+
+# システムプロンプトのSystemMessageを作成する関数（同じプロンプトの組み合わせに対しては作成済みのものを返す）
+@lru_cache(maxsize=32)
+def _build_prefix(prompts: Tuple[str, ...], cache_breakpoint: int) -> Tuple[Any, ...]:
+    messages = [SystemMessage(content=prompt) for prompt in prompts]
+    
+    # 固定部分の最後のシステムプロンプトをcache_control付きのコンテンツブロックにし、
+    # それより前のプレフィックスをプロバイダ側でキャッシュさせる
+    if 0 < cache_breakpoint <= len(prompts):
+        messages[cache_breakpoint - 1] = SystemMessage(content=[{
+            "type": "text",
+            "text": prompts[cache_breakpoint - 1],
+            "cache_control": {"type": "ephemeral"}
+        }])
+    return tuple(messages)
+
+def prepare_prefix(system_prompt: Optional[List[str]] = None, cache_breakpoint: int = 0) -> Tuple[Any, ...]:
+    """
+    システムプロンプトのリストから、LLMに渡すメッセージの先頭部分（SystemMessageのタプル）を作成する関数
+    
+    同じシステムプロンプトで何度も呼び出す場合（リトライや一括処理など）は、
+    作成済みの同じメッセージオブジェクトを返すため、SystemMessageの作成を繰り返さない。
+    返り値は共有されるため、変更せずにlist()でコピーしてから後続のメッセージを追加すること。
+    
+    Args:
+        system_prompt (List[str], optional): システムプロンプトのリスト
+        cache_breakpoint (int, optional): system_promptの先頭から何件が固定部分か。
+            1以上の場合、固定部分の最後のシステムプロンプトにcache_controlを設定する
+            （プロンプトキャッシュに対応したプロバイダのみで指定すること）
+        
+    Returns:
+        Tuple[Any, ...]: SystemMessageのタプル
+    """
+    return _build_prefix(tuple(system_prompt or ()), cache_breakpoint)
+
+# 指定されたプロバイダで有効なプロンプトキャッシュの境界を返す関数
+def _effective_cache_breakpoint(provider: str, cache_breakpoint: int) -> int:
+    """cache_controlによるプロンプトキャッシュの境界はOpenRouterのみで設定し、それ以外のプロバイダでは0を返す"""
+    return cache_breakpoint if provider == "openrouter" else 0
+
+# 添付画像をメッセージのコンテンツブロックに変換する関数
+def _image_parts(files_data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """添付ファイルのうち画像をimage_urlのコンテンツブロックのリストに変換する関数"""
+    parts = []
+    for file_data in files_data:
+        if file_data.get("type") == "画像" and file_data.get("content"):
+            try:
+                # Base64エンコード済みのデータURLはfile_dataに保存し、同じ画像で再利用する
+                data_url = file_data.get("_data_url")
+                if data_url is None:
+                    # 画像データをBase64エンコード（Base64の出力はASCIIのみ）
+                    image_content = file_data.get("content", b"")
+                    image_b64 = base64.b64encode(memoryview(image_content)).decode('ascii')
+                    
+                    # 画像のMIMEタイプを取得
+                    mime_type = file_data.get("content_type")
+                    data_url = file_data["_data_url"] = f"data:{mime_type};base64,{image_b64}"
+                
+                # 画像データを追加
+                parts.append({
+                    "type": "image_url",
+                    "image_url": {
+                        "url": data_url
+                    }
+                })
+                # print(f"画像データを追加: {file_data.get('filename')} ({len(data_url)} バイト)")
+            except Exception as img_error:
+                print(f"画像データの処理エラー: {str(img_error)}")
+    return parts
+
+# メッセージタイプごとの変換関数
+# 各関数はstateのメッセージ、添付ファイルのデータリスト、最新のメッセージかどうかを受け取り、LLMに渡すメッセージを返す
+def _convert_human(msg, files_data, is_last):
+    content = msg.content
+    # 画像データがある場合はマルチモーダル処理（最新のメッセージの場合のみ）
+    if files_data and is_last:
+        image_parts = _image_parts(files_data)
+        if image_parts:
+            content = [{"type": "text", "text": msg.content}, *image_parts]
+    human_msg = HumanMessage(content=content)
+    if hasattr(msg, 'additional_kwargs'):
+        human_msg.additional_kwargs = msg.additional_kwargs
+    return human_msg
+
+def _convert_ai(msg, files_data, is_last):
+    ai_msg = AIMessage(content=msg.content)
+    if hasattr(msg, 'additional_kwargs'):
+        ai_msg.additional_kwargs = msg.additional_kwargs
+    return ai_msg
+
+def _convert_system(msg, files_data, is_last):
+    system_msg = SystemMessage(content=msg.content)
+    if hasattr(msg, 'additional_kwargs'):
+        system_msg.additional_kwargs = msg.additional_kwargs
+    return system_msg
+
+# ツールメッセージをシステムメッセージに変換するかどうか
+# geminiを使う場合はtrue。geminiはroleにtoolを許容していないため
+_TOOL_AS_SYSTEM = True
+
+def _convert_tool(msg, files_data, is_last):
+    # ツール名を取得
+    name = getattr(msg, 'name', '不明なツール')
     
+    # Gemini使用時はtoolメッセージをsystemメッセージに変換
+    if _TOOL_AS_SYSTEM:
+        # ツールメッセージをシステムメッセージに変換
+        converted = SystemMessage(content=f"ツール「{name}」の結果:\n{msg.content}")
     else:
-        print(f"警告: サポートされていないLLMプロバイダです: {llm_provider or default_provider}")
-        return {"error": f"サポートされていないLLMプロバイダです: {llm_provider or default_provider}"}
+        # OpenAIなど他のLLMではFunctionMessageをそのまま使用
+        from langchain.schema import FunctionMessage
+        converted = FunctionMessage(name=name, content=msg.content)
+    if hasattr(msg, 'additional_kwargs'):
+        converted.additional_kwargs = msg.additional_kwargs
+    return converted
+
+_CONVERTERS = {
+    "human": _convert_human,
+    "ai": _convert_ai,
+    "system": _convert_system,
+    "tool": _convert_tool,
+    "function": _convert_tool,
+}
+
+# LLMに渡すメッセージを準備する関数
+def _build_messages(state: Dict[str, Any], system_prompt: Optional[List[str]] = None, files_data: Optional[List[Dict[str, Any]]] = None, cache_breakpoint: int = 0) -> List[Any]:
+    """
+    システムプロンプトとstateのメッセージから、LLMに渡すLangChainメッセージのリストを作成する関数
+    
+    Args:
+        state (Dict[str, Any]): 現在の状態（messagesを含む）
+        system_prompt (List[str], optional): システムプロンプトのリスト
+        files_data (List[Dict[str, Any]], optional): 添付ファイルのデータリスト（最新のユーザーメッセージに添付）
+        cache_breakpoint (int, optional): prepare_prefixと同じ
+        
+    Returns:
+        List[Any]: LangChainメッセージのリスト
+    """
+    # システムプロンプトのメッセージ（作成済みのものを再利用）をコピーして準備
+    messages = list(prepare_prefix(system_prompt, cache_breakpoint))
+    
+    # stateからメッセージを取得
+    state_messages = state.get("messages", [])
+    
+    # stateのメッセージを適切なLangChainメッセージに変換（メッセージタイプごとの変換関数を引く）
+    last_msg = state_messages[-1] if state_messages else None
+    get_converter = _CONVERTERS.get
+    for msg in state_messages:
+        if hasattr(msg, 'type') and hasattr(msg, 'content'):
+            converter = get_converter(msg.type)
+            if converter is not None:
+                messages.append(converter(msg, files_data, msg is last_msg))
+    
+    return messages
+
+# LLMを呼び出してAPIログを保存する関数
+def _invoke_llm(llm, messages: List[Any], api_url: str, api_name: str):
+    """
+    LLMを呼び出し、リクエストとレスポンスをAPIログに保存する関数
+    
+    Args:
+        llm: LangChainのチャットモデル
+        messages (List[Any]): LLMに渡すメッセージのリスト
+        api_url (str): APIログに記録するAPIのURL
+        api_name (str): APIログに記録する呼び出し元の名前
+        
+    Returns:
+        LLMからの応答メッセージ
+    """
+    # LLMを呼び出し
+    response = llm.invoke(messages)
+    
+    # LLMからの生の応答をprint
+    # print("\n=== LLMからの生の応答 ===")
+    # print(response.content)
+    # print("========================\n")
+    
+    _save_invoke_log(messages, response, api_url, api_name)
+    return response
+
+# LLMの応答をストリーミングで受け取り、APIログを保存する関数
+def _stream_llm(llm, messages: List[Any], api_url: str, api_name: str):
+    """
+    LLMの応答をストリーミングで受け取り、最初のトップレベルのJSONオブジェクトが閉じた時点で受信を打ち切る関数
+    
+    文字列リテラルの外にある「{」「}」の深さを数え、深さが0に戻るたびに
+    _DECODER.raw_decodeでJSONとして読み取れるかを試す。読み取れた場合は残りの生成を待たない。
+    ストリーミングに対応していないモデルでは、LangChainが通常の呼び出しにフォールバックする。
+    受信したチャンクのresponse_metadataとusage_metadataは結合して応答メッセージに引き継ぐ
+    （受信を打ち切った場合、最後のチャンクで送られる使用量などは含まれない）。
+    JSONオブジェクトの後に続くテキスト（コードブロックの閉じ記号など）は受信しないため、
+    呼び出し側で明示的に有効にした場合のみ使用する。
+    
+    Args:
+        llm: LangChainのチャットモデル
+        messages (List[Any]): LLMに渡すメッセージのリスト
+        api_url (str): APIログに記録するAPIのURL
+        api_name (str): APIログに記録する呼び出し元の名前
         
+    Returns:
+        AIMessage: 受信した内容（JSONオブジェクトの終わりまで）を持つ応答メッセージ
+    """
+    parts = []
+    pos = 0  # これまでに受信した文字数
+    depth = 0  # 「{」の入れ子の深さ
+    start = 0  # 現在のトップレベルのオブジェクトの開始位置
+    in_string = False
+    escape = False
+    completed = False
+    aggregate = None  # 受信したチャンクを結合したもの（メタデータの引き継ぎ用）
+    
+    stream = llm.stream(messages)
     try:
-        # LLMを呼び出し
-        response = llm.invoke(messages)
-        
-        # LLMからの生の応答をprint
-        # print("\n=== LLMからの生の応答 ===")
-        # print(response.content)
-        # print("========================\n")
-        
-        # レスポンスオブジェクトの詳細情報を出力（デバッグ用）
-        # print("\n=== レスポンスオブジェクトの詳細 ===")
-        # print(f"response: {response}")
-        
-        # APIログを保存（メッセージの全属性を含める）
-        # メッセージの全属性を取得
-        messages_with_role = []
-        for m in messages:
-            if hasattr(m, "type") and hasattr(m, "content"):
-                # LangChainのメッセージオブジェクトから全属性を取得
-                message_data = {}
-                
-                # 基本属性を追加
-                message_data["role"] = m.type
-                message_data["content"] = m.content
-                
-                # その他の属性を追加
-                for attr in dir(m):
-                    # 特殊属性とメソッドを除外
-                    if not attr.startswith('_') and not callable(getattr(m, attr)):
-                        # 既に追加した属性は除外
-                        if attr not in ["type", "content"]:
-                            try:
-                                attr_value = getattr(m, attr)
-                                # JSONシリアライズ可能な値のみ追加
-                                if attr_value is None or isinstance(attr_value, (str, int, float, bool, list, dict)):
-                                    message_data[attr] = attr_value
-                            except Exception as e:
-                                # 取得できない属性は無視
-                                print(f"属性 {attr} の取得に失敗: {str(e)}")
-                
-                messages_with_role.append(message_data)
-            else:
-                # 通常の文字列の場合はそのまま追加
-                messages_with_role.append({"role": "user", "content": str(m)})
-        
-        # # デバッグ情報を出力
-        # print("\n=== デバッグ情報 ===")
-        # print(f"llm_provider: {llm_provider}")
-        # print(f"api_settings: {api_settings}")
-        # print(f"messages_with_role: {messages_with_role}")
-        # print(f"response.content: {response.content}")
-        # print("===================\n")
-        
-        # APIログを保存
-        api_url_to_log = "https://generativelanguage.googleapis.com" if llm_provider == "gemini" else api_url
-        
-        # JSONシリアライズ可能なオブジェクトのみを抽出
-        serializable_messages = []
-        for m in messages_with_role:
-            serializable_message = {}
-            for key, value in m.items():
-                try:
-                    # 試験的にJSONシリアライズしてみる
-                    json.dumps({key: value})
-                    serializable_message[key] = value
-                except TypeError:
-                    # シリアライズできない場合は文字列に変換
-                    serializable_message[key] = str(value)
-            serializable_messages.append(serializable_message)
+        for chunk in stream:
+            aggregate = chunk if aggregate is None else aggregate + chunk
+            piece = chunk.content if isinstance(chunk.content, str) else ""
+            parts.append(piece)
+            for ch in piece:
+                if in_string:
+                    if escape:
+                        escape = False
+                    elif ch == "\\":
+                        escape = True
+                    elif ch == '"':
+                        in_string = False
+                elif ch == '"':
+                    in_string = depth > 0
+                elif ch == "{":
+                    if depth == 0:
+                        start = pos
+                    depth += 1
+                elif ch == "}" and depth > 0:
+                    depth -= 1
+                    if depth == 0:
+                        text = "".join(parts)
+                        try:
+                            _, end = _DECODER.raw_decode(text, start)
+                        except json.JSONDecodeError:
+                            pass
+                        else:
+                            parts = [text[:end]]
+                            completed = True
+                            break
+                pos += 1
+            if completed:
+                break
+    finally:
+        # 受信を打ち切った場合もストリームを閉じて接続を解放する
+        close = getattr(stream, "close", None)
+        if close is not None:
+            close()
+    
+    if aggregate is None:
+        response = AIMessage(content="".join(parts))
+    else:
+        response = AIMessage(
+            content="".join(parts),
+            additional_kwargs=aggregate.additional_kwargs,
+            response_metadata=aggregate.response_metadata,
+            usage_metadata=getattr(aggregate, "usage_metadata", None),
+            id=aggregate.id
+        )
+    _save_invoke_log(messages, response, api_url, api_name)
+    return response
+
+# LLMを非同期に呼び出してAPIログを保存する関数
+async def _ainvoke_llm(llm, messages: List[Any], api_url: str, api_name: str):
+    """
+    LLMを非同期に呼び出し、リクエストとレスポンスをAPIログに保存する関数
+    
+    APIログの保存（ファイル書き込み）は別スレッドで行い、イベントループを止めない
+    
+    Args:
+        llm: LangChainのチャットモデル
+        messages (List[Any]): LLMに渡すメッセージのリスト
+        api_url (str): APIログに記録するAPIのURL
+        api_name (str): APIログに記録する呼び出し元の名前
         
+    Returns:
+        LLMからの応答メッセージ
+    """
+    response = await llm.ainvoke(messages)
+    await asyncio.to_thread(_save_invoke_log, messages, response, api_url, api_name)
+    return response
+
+# APIログに記録するメッセージの属性（role, content以外）
+_MESSAGE_FIELDS = ("name", "tool_call_id", "additional_kwargs", "response_metadata")
+# そのままJSONに書き込める値の型
+_JSON_TYPES = (str, int, float, bool, type(None), list, dict)
+
+# メッセージをAPIログ用の辞書に変換する関数
+def _serialize_message(m) -> Dict[str, Any]:
+    """
+    LangChainのメッセージをAPIログに記録する辞書に変換する関数
+    
+    role, contentと、_MESSAGE_FIELDSのうち値が設定されている属性のみを含める。
+    JSONの型でない属性値はstrに変換する（試しにjson.dumpsして例外を捕まえることはしない）
+    
+    Args:
+        m: LangChainのメッセージオブジェクト（それ以外の場合は文字列として扱う）
+        
+    Returns:
+        Dict[str, Any]: APIログに記録するメッセージ
+    """
+    if not (hasattr(m, "type") and hasattr(m, "content")):
+        # 通常の文字列の場合はそのまま追加
+        return {"role": "user", "content": str(m)}
+    
+    message_data = {"role": m.type, "content": m.content}
+    for field in _MESSAGE_FIELDS:
+        value = getattr(m, field, None)
+        if value is not None:
+            # JSONの型でない値はここでstrに変換する（list/dictの中の値はログの書き込み時に変換される）
+            message_data[field] = value if isinstance(value, _JSON_TYPES) else str(value)
+    return message_data
+
+# LLM呼び出しのリクエストとレスポンスをAPIログに保存する関数
+def _save_invoke_log(messages: List[Any], response, api_url: str, api_name: str) -> None:
+    """
+    LLMに渡したメッセージとLLMからの応答をAPIログに保存する関数
+    
+    Args:
+        messages (List[Any]): LLMに渡したメッセージのリスト
+        response: LLMからの応答メッセージ
+        api_url (str): APIログに記録するAPIのURL
+        api_name (str): APIログに記録する呼び出し元の名前
+    """
+    # APIログが無効な場合は、ログ用のメッセージの変換も行わない
+    if not ApiLogger.enabled:
+        return
+    
+    # APIログを保存（シリアライズできない値はApiLogger側でstrに変換される）
+    serializable_messages = [_serialize_message(m) for m in messages]
+    
+    ApiLogger.save_api_log(
+        url=api_url,
+        headers={"HTTP-Referer": "http://localhost:5000", "X-Title": "Miku Agent"},
+        request_data={"messages": serializable_messages},
+        response_json={"content": str(response.content)},
+        api_name=api_name
+    )
+
+# LLM呼び出しのエラーをAPIログに保存する関数
+def _log_llm_error(messages: List[Any], api_url: str, provider: str, api_name: str, error: Exception) -> None:
+    """
+    LLM呼び出しでエラーが発生した場合に、リクエスト内容とエラー情報をAPIログに保存する関数
+    
+    Args:
+        messages (List[Any]): LLMに渡したメッセージのリスト
+        api_url (str): APIログに記録するAPIのURL
+        provider (str): LLMプロバイダ名
+        api_name (str): APIログに記録する呼び出し元の名前
+        error (Exception): 発生したエラー
+    """
+    # APIログが無効な場合は、ログ用のメッセージの変換も行わない
+    if not ApiLogger.enabled:
+        return
+    
+    try:
+        # メッセージを成功時と同じ形式に変換
+        serializable_messages = [_serialize_message(m) for m in messages]
+        
+        # エラー情報を含めてログを保存
         ApiLogger.save_api_log(
-            url=api_url_to_log,
+            url=api_url,
             headers={"HTTP-Referer": "http://localhost:5000", "X-Title": "Miku Agent"},
-            request_data={"messages": serializable_messages},
-            response_json={"content": str(response.content)},
-            api_name=api_name
+            request_data={"messages": serializable_messages, "provider": provider},
+            response_json={"error": str(error)},  # エラー情報をレスポンスとして記録
+            api_name=f"{api_name}_error"  # エラーログであることを明示
         )
         
+        # デバッグ情報を出力
+        print("\n=== エラー時のデバッグ情報 ===")
+        print(f"llm_provider: {provider}")
+        print(f"messages_with_role: {json.dumps(serializable_messages, ensure_ascii=False, default=str)}")
+        print("===================\n")
+    
+    except Exception as log_error:
+        # ログ保存中にエラーが発生した場合
+        print(f"エラーログの保存に失敗: {str(log_error)}")
+
+# LLMの呼び出しを準備する関数
+def _prepare_llm_call(
+    state: Dict[str, Any],
+    system_prompt: Optional[List[str]],
+    files_data: Optional[List[Dict[str, Any]]],
+    llm_provider: str,
+    cache_breakpoint: int
+) -> Tuple[str, Any, str, List[Any]]:
+    """
+    LLMプロバイダを決定してLLMを初期化し、LLMに渡すメッセージを作成する関数（call_llmとacall_llmで共通）
+    
+    Args:
+        state (Dict[str, Any]): 現在の状態（messagesを含む）
+        system_prompt (List[str], optional): システムプロンプトのリスト
+        files_data (List[Dict[str, Any]], optional): 添付ファイルのデータリスト
+        llm_provider (str): 使用するLLMプロバイダ（空文字列の場合はデフォルト）
+        cache_breakpoint (int): call_llmと同じ
+        
+    Returns:
+        Tuple[str, Any, str, List[Any]]: LLMプロバイダ名、LLM、APIのURL、LLMに渡すメッセージのリスト
+        
+    Raises:
+        LLMSetupError: LLMの初期化に失敗した場合
+    """
+    # 設定を取得（初回の呼び出し後はキャッシュを使用）
+    api_settings = _get_api_settings()
+    
+    # LLMプロバイダを決定し、LLMを初期化
+    provider = _resolve_provider(llm_provider)
+    llm, api_url = _create_llm(provider, api_settings)
+    
+    # stateのメッセージをLangChainメッセージに変換（プロンプトキャッシュの境界も設定）
+    messages = _build_messages(state, system_prompt, files_data, _effective_cache_breakpoint(provider, cache_breakpoint))
+    return provider, llm, api_url, messages
+
+# LLM呼び出しのエラーを処理する関数
+def _llm_error_result(messages: List[Any], api_url: str, provider: str, api_name: str, error: Exception) -> Dict[str, Any]:
+    """
+    LLM呼び出しのエラーを出力してAPIログに保存し、呼び出し元に返すエラーの辞書を作成する関数（call_llmとacall_llmで共通）
+    
+    Args:
+        messages (List[Any]): LLMに渡したメッセージのリスト
+        api_url (str): APIログに記録するAPIのURL
+        provider (str): LLMプロバイダ名
+        api_name (str): APIログに記録する呼び出し元の名前
+        error (Exception): 発生したエラー
+        
+    Returns:
+        Dict[str, Any]: エラー情報（{"error": エラーメッセージ}）
+    """
+    print(f"LLM呼び出しエラー: {str(error)}")
+    
+    # エラー時もAPIログを保存
+    _log_llm_error(messages, api_url, provider, api_name, error)
+    
+    return {"error": str(error)}
+
+def call_llm(
+    state: Dict[str, Any],
+    system_prompt: Optional[List[str]] = None,
+    files_data: Optional[List[Dict[str, Any]]] = None,
+    api_name: str = "",  # 呼び出し元を識別するためのAPI名
+    llm_provider: str = "",  # デフォルトはなし。openrouter、geminiが選択可能
+    expected_schema: Optional[Dict[str, Any]] = None,  # 期待するJSONスキーマ
+    cache_breakpoint: int = 0,  # 先頭から何件のシステムプロンプトを固定部分（キャッシュ対象）とするか
+    stream: bool = False  # Trueの場合は応答をストリーミングで受け取る
+) -> Dict[str, Any]:
+    """
+    LangChainを使用してLLMを呼び出す関数
+    
+    Args:
+        state (Dict[str, Any]): 現在の状態（messagesを含む）
+        system_prompt (List[str], optional): システムプロンプトのリスト
+        files_data (List[Dict[str, Any]], optional): 添付ファイルのデータリスト
+        api_name (str, optional): APIログに記録する呼び出し元の名前
+        llm_provider (str, optional): 使用するLLMプロバイダ（"openrouter"または"gemini"）
+        expected_schema (Dict[str, Any], optional): 期待するJSONスキーマ
+        cache_breakpoint (int, optional): system_promptの先頭から何件が呼び出し間で変わらない固定部分かを表す。
+            1以上を指定すると、OpenRouter使用時に固定部分の最後のシステムプロンプトへ
+            プロンプトキャッシュの境界（cache_control）を設定する。0の場合は設定しない
+        stream (bool, optional): Trueの場合は応答をストリーミングで受け取り、
+            最初のJSONオブジェクトが閉じた時点で残りの生成を待たずにパースする
+        
+    Returns:
+        Dict[str, Any]: 処理結果（JSONパース済みの辞書オブジェクト）
+        
+    Note:
+        この関数は内部でparse_json_responseを呼び出し、LLMからの応答を
+        JSONとしてパースした結果を返します。返り値はすでにパース済みの
+        辞書オブジェクトであるため、呼び出し元で再度parse_json_responseを
+        呼び出す必要はありません。
+    """
+    try:
+        provider, llm, api_url, messages = _prepare_llm_call(state, system_prompt, files_data, llm_provider, cache_breakpoint)
+    except LLMSetupError as e:
+        return {"error": str(e)}
+        
+    try:
+        # LLMを呼び出し、APIログを保存
+        if stream:
+            response = _stream_llm(llm, messages, api_url, api_name)
+        else:
+            response = _invoke_llm(llm, messages, api_url, api_name)
+        
         # JSONパース処理を共通関数で行う
         # 例外が発生した場合は呼び出し元に伝播させる
         parsed_result = parse_json_response(response.content, expected_schema=expected_schema)
@@ -409,55 +775,232 @@ def call_llm(
         return parsed_result
             
     except Exception as e:
-        print(f"LLM呼び出しエラー: {str(e)}")
+        return _llm_error_result(messages, api_url, provider, api_name, e)
+
+async def acall_llm(
+    state: Dict[str, Any],
+    system_prompt: Optional[List[str]] = None,
+    files_data: Optional[List[Dict[str, Any]]] = None,
+    api_name: str = "",  # 呼び出し元を識別するためのAPI名
+    llm_provider: str = "",  # デフォルトはなし。openrouter、geminiが選択可能
+    expected_schema: Optional[Dict[str, Any]] = None,  # 期待するJSONスキーマ
+    cache_breakpoint: int = 0  # 先頭から何件のシステムプロンプトを固定部分（キャッシュ対象）とするか
+) -> Dict[str, Any]:
+    """
+    call_llmの非同期版（llm.ainvokeを使用）
+    
+    引数と返り値はcall_llmと同じ。互いに独立した複数の呼び出しを並行して実行する場合に使用する。
+    
+    Returns:
+        Dict[str, Any]: 処理結果（JSONパース済みの辞書オブジェクト）
+    """
+    try:
+        provider, llm, api_url, messages = _prepare_llm_call(state, system_prompt, files_data, llm_provider, cache_breakpoint)
+    except LLMSetupError as e:
+        return {"error": str(e)}
+    
+    try:
+        # LLMを呼び出し、APIログを保存
+        response = await _ainvoke_llm(llm, messages, api_url, api_name)
+        return parse_json_response(response.content, expected_schema=expected_schema)
+    
+    except Exception as e:
+        # エラーログの保存は別スレッドで行い、イベントループを止めない
+        return await asyncio.to_thread(_llm_error_result, messages, api_url, provider, api_name, e)
+
+class _TokenBucket:
+    """
+    1分あたりのリクエスト数（RPM）を制限するトークンバケット
+    
+    asyncio.Queueをバケットとして使い、バックグラウンドのタスクが60/rpm秒ごとにトークンを1つ補充する。
+    バケットは空の状態から始め、トークンは1つまでしか貯めないため、
+    どの60秒間でも呼び出しはrpm回（補充の直前に貯まっていた1回分を含めてもrpm+1回）までになる
+    """
+    
+    def __init__(self, rpm: int):
+        if rpm <= 0:
+            raise ValueError(f"rpmには1以上の値を指定してください: {rpm}")
+        self._interval = 60.0 / rpm
+        self._tokens = asyncio.Queue(maxsize=1)
+        self._refill_task = asyncio.create_task(self._refill())
+    
+    async def _refill(self):
+        while True:
+            await asyncio.sleep(self._interval)
+            if not self._tokens.full():
+                self._tokens.put_nowait(None)
+    
+    async def acquire(self):
+        await self._tokens.get()
+    
+    def close(self):
+        self._refill_task.cancel()
+
+async def run_batch(
+    states: List[Dict[str, Any]],
+    concurrency: int = 10,
+    rpm: int = 100,
+    **kwargs
+) -> List[Dict[str, Any]]:
+    """
+    複数の独立したstateに対してacall_llmを並行して実行する関数
+    
+    同時実行数をconcurrencyに、1分あたりのリクエスト数をrpmに制限する。
+    
+    Args:
+        states (List[Dict[str, Any]]): 問い合わせごとの状態（messagesを含む）のリスト
+        concurrency (int, optional): 同時に実行するLLM呼び出しの上限（デフォルト10）
+        rpm (int, optional): 1分あたりのLLM呼び出しの上限（デフォルト100）
+        **kwargs: acall_llmに渡す引数（system_prompt, api_name, llm_providerなど）
+        
+    Returns:
+        List[Dict[str, Any]]: statesと同じ順の処理結果のリスト
+        
+    Raises:
+        ValueError: rpmが0以下の場合
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    bucket = _TokenBucket(rpm)
+    
+    async def _run(state):
+        async with semaphore:
+            await bucket.acquire()
+            return await acall_llm(state, **kwargs)
+    
+    try:
+        return await asyncio.gather(*(_run(state) for state in states))
+    finally:
+        bucket.close()
+
+# 複数の問い合わせをまとめて回答させるための指示のテンプレート
+_BATCH_INSTRUCTION_TMPL = (
+    "この後に続くメッセージには、{n}件の独立した問い合わせ（### Q1 〜 ### Q{n}）が含まれています。\n"
+    "それぞれの問い合わせに対して、これまでの指示に従って個別に回答してください。\n"
+    "回答は、各問い合わせに対するJSONオブジェクトを問い合わせの順に並べた、長さ{n}のJSON配列として返してください"
+    "（マークダウンのコードブロックは使わず、直接JSON配列を返してください）。\n"
+)
+
+# 1回のLLM呼び出しにまとめる問い合わせ数のデフォルトの上限
+_DEFAULT_MAX_BATCH = 16
+
+def parse_json_response_batch(content: str, n: int, expected_schema: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """
+    まとめて問い合わせたLLMのレスポンスから、問い合わせごとのJSONを抽出する関数
+    
+    JSON配列（コードブロック内または全体）を優先し、見つからない場合は
+    ```json コードブロックに個別に書かれたJSONオブジェクトを順に取得する。
+    
+    Args:
+        content (str): LLMのレスポンス内容
+        n (int): 問い合わせの数
+        expected_schema (Dict[str, Any], optional): 各回答が従うべきJSONスキーマ
+        
+    Returns:
+        List[Dict[str, Any]]: 問い合わせ順の回答のリスト（長さn）
+            取得できなかった回答やスキーマ検証に失敗した回答は {"error": エラーメッセージ} になる
+    """
+    results = None
+    
+    # JSON配列として返された場合
+    try:
+        parsed = parse_json_response(content)
+        if isinstance(parsed, list):
+            results = parsed
+    except (json.JSONDecodeError, ValueError):
+        pass
+    
+    # 個別のコードブロックで返された場合
+    if results is None:
+        results = []
+        for match in _CODE_BLOCK_OBJECT_RE.finditer(content):
+            try:
+                results.append(_json_loads(match.group(1)))
+            except json.JSONDecodeError:
+                results.append({"error": "JSONパースに失敗しました"})
+    
+    if len(results) != n:
+        print(f"警告: 問い合わせ数({n})と回答数({len(results)})が一致しません")
+    
+    # 問い合わせ順に回答を割り当てる（不足分はエラー）
+    batch_results = []
+    for i in range(n):
+        result = results[i] if i < len(results) else {"error": "回答が見つかりません"}
+        if not isinstance(result, dict):
+            result = {"error": f"回答がJSONオブジェクトではありません: {result}"}
+        elif expected_schema and "error" not in result:
+            validation_errors = validate_schema(result, expected_schema)
+            if validation_errors:
+                print(f"スキーマ検証エラー(Q{i + 1}): {validation_errors}")
+                result = {"error": f"スキーマ検証エラー: {validation_errors}"}
+        batch_results.append(result)
+    return batch_results
+
+def call_llm_batch(
+    states: List[Dict[str, Any]],
+    system_prompt: Optional[List[str]] = None,
+    api_name: str = "",  # 呼び出し元を識別するためのAPI名
+    llm_provider: str = "",  # デフォルトはなし。openrouter、geminiが選択可能
+    expected_schema: Optional[Dict[str, Any]] = None,  # 各回答が従うべきJSONスキーマ
+    cache_breakpoint: int = 0,  # 先頭から何件のシステムプロンプトを固定部分（キャッシュ対象）とするか
+    max_batch: int = _DEFAULT_MAX_BATCH  # 1回のLLM呼び出しにまとめる問い合わせ数の上限
+) -> List[Dict[str, Any]]:
+    """
+    複数の独立した問い合わせを、共通のシステムプロンプトで1回のLLM呼び出しにまとめて処理する関数
+    
+    各stateの会話履歴を「### Q{番号}」の見出し付きで1つのメッセージにまとめ、
+    回答をJSON配列で返させることで、システムプロンプトの送信を問い合わせ数で割り勘にする。
+    問い合わせ数がmax_batchを超える場合は、max_batch件ずつに分けて呼び出す。
+    
+    Args:
+        states (List[Dict[str, Any]]): 問い合わせごとの状態（messagesを含む）のリスト
+        system_prompt (List[str], optional): すべての問い合わせに共通のシステムプロンプトのリスト
+        api_name (str, optional): APIログに記録する呼び出し元の名前
+        llm_provider (str, optional): 使用するLLMプロバイダ（"openrouter"または"gemini"）
+        expected_schema (Dict[str, Any], optional): 各回答が従うべきJSONスキーマ
+        cache_breakpoint (int, optional): call_llmと同じ
+        max_batch (int, optional): 1回のLLM呼び出しにまとめる問い合わせ数の上限（デフォルト16）
+        
+    Returns:
+        List[Dict[str, Any]]: statesと同じ順の回答のリスト（JSONパース済み）
+            失敗した問い合わせは {"error": エラーメッセージ} になる
+    """
+    # 設定を取得（初回の呼び出し後はキャッシュを使用）
+    api_settings = _get_api_settings()
+    
+    # LLMプロバイダを決定し、LLMを初期化
+    provider = _resolve_provider(llm_provider)
+    try:
+        llm, api_url = _create_llm(provider, api_settings)
+    except LLMSetupError as e:
+        return [{"error": str(e)} for _ in states]
+    
+    # 共通のシステムプロンプトのメッセージは、すべての呼び出しで同じものを使う
+    prefix = prepare_prefix(system_prompt, _effective_cache_breakpoint(provider, cache_breakpoint))
+    
+    results = []
+    for start in range(0, len(states), max(1, max_batch)):
+        chunk = states[start:start + max(1, max_batch)]
+        
+        # 共通のシステムプロンプトの後に、まとめて回答させるための指示を追加
+        messages = list(prefix)
+        messages.append(SystemMessage(content=_BATCH_INSTRUCTION_TMPL.format(n=len(chunk))))
         
-        # エラー時もAPIログを保存
         try:
-            # メッセージのroleとcontentを取得（成功時と同じ処理）
-            messages_with_role = []
-            for m in messages:
-                if hasattr(m, "type") and hasattr(m, "content"):
-                    # LangChainのメッセージオブジェクトからroleとcontentを取得
-                    role = m.type
-                    content = m.content
-                    messages_with_role.append({"role": role, "content": content})
-                else:
-                    # 通常の文字列の場合はそのまま追加
-                    messages_with_role.append({"role": "user", "content": str(m)})
-            
-            # エラー情報を含めてログを保存
-            api_url_to_log = "https://generativelanguage.googleapis.com" if llm_provider == "gemini" else api_url
-            
-            # JSONシリアライズ可能なオブジェクトのみを抽出
-            serializable_messages = []
-            for m in messages_with_role:
-                serializable_message = {}
-                for key, value in m.items():
-                    try:
-                        # 試験的にJSONシリアライズしてみる
-                        json.dumps({key: value})
-                        serializable_message[key] = value
-                    except TypeError:
-                        # シリアライズできない場合は文字列に変換
-                        serializable_message[key] = str(value)
-                serializable_messages.append(serializable_message)
-            
-            ApiLogger.save_api_log(
-                url=api_url_to_log,
-                headers={"HTTP-Referer": "http://localhost:5000", "X-Title": "Miku Agent"},
-                request_data={"messages": serializable_messages, "provider": llm_provider or default_provider},
-                response_json={"error": str(e)},  # エラー情報をレスポンスとして記録
-                api_name=f"{api_name}_error"  # エラーログであることを明示
+            # 問い合わせごとの会話履歴を見出し付きで1つのメッセージにまとめる
+            queries = "\n\n".join(
+                f"### Q{i}\n{extract_conversation_history(state.get('messages', []))}"
+                for i, state in enumerate(chunk, 1)
             )
+            messages.append(HumanMessage(content=queries))
             
-            # デバッグ情報を出力
-            print("\n=== エラー時のデバッグ情報 ===")
-            print(f"llm_provider: {llm_provider or default_provider}")
-            print(f"messages_with_role: {json.dumps(messages_with_role, ensure_ascii=False)}")
-            print("===================\n")
-        
-        except Exception as log_error:
-            # ログ保存中にエラーが発生した場合
-            print(f"エラーログの保存に失敗: {str(log_error)}")
-        
-        return {"error": str(e)}
+            # LLMを呼び出し、APIログを保存
+            response = _invoke_llm(llm, messages, api_url, api_name)
+            results.extend(parse_json_response_batch(response.content, len(chunk), expected_schema=expected_schema))
+        except Exception as e:
+            print(f"LLM一括呼び出しエラー: {str(e)}")
+            
+            # エラー時もAPIログを保存
+            _log_llm_error(messages, api_url, provider, api_name, e)
+            results.extend({"error": str(e)} for _ in chunk)
+    
+    return results
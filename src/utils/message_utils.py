@@ -0,0 +1,130 @@
+"""
+メッセージ処理に関するユーティリティモジュール
+各ノードで共通して使用するメッセージリストの整形・抽出処理をまとめる
+"""
+from datetime import datetime
+
+# メッセージタイプから会話履歴上のロール名への対応表
+# system（plannerノード）とtool/functionはノード情報やツール名に応じて個別に決定する
+_ROLE_MAP = {"human": "ユーザー", "ai": "アシスタント", "system": "システム"}
+
+# メッセージ1件を整形する関数
+def _format_message(msg):
+    """
+    メッセージ1件を会話履歴用の文字列に整形する関数
+
+    Args:
+        msg: LangChainのメッセージオブジェクト
+
+    Returns:
+        str: 整形されたメッセージ
+
+    Raises:
+        ValueError: サポートされていないメッセージ形式の場合
+    """
+    # LangChainのメッセージオブジェクトの場合
+    if hasattr(msg, 'content') and hasattr(msg, 'type'):
+        # additional_kwargsは一度だけ取得し、ノード情報と追加情報の両方で使い回す
+        # 空の辞書（通常のメッセージの大半）はNoneとして扱い、以降の処理を省く
+        kw = getattr(msg, 'additional_kwargs', None)
+        if not kw or not isinstance(kw, dict):
+            kw = None
+
+        # ノード情報を取得
+        node_info = kw.get("node_info", {}) if kw is not None else None
+
+        # メッセージタイプに基づいてロールを決定
+        msg_type = msg.type
+        if msg_type == "function" or msg_type == "tool":
+            # 関数名/ツール名を取得
+            name = getattr(msg, 'name', '不明なツール')
+            role = f"ツール({name})"
+        elif msg_type == "system" and node_info and node_info.get("node_name", "") == "planner_node":
+            role = "思考プロセス"  # plannerノードの場合は「思考プロセス」として表示
+        else:
+            role = _ROLE_MAP.get(msg_type, msg_type)
+
+        # additional_kwargsから追加情報を取得（すべてのキーを取得）
+        # すべてのメッセージタイプで実行し、各行を一度のjoinで連結する
+        if kw is None:
+            return f"{role}: {msg.content}"
+        kw_tail = "\n".join(f"[{key}: {value}]" for key, value in kw.items())
+
+        # 基本メッセージに追加情報を付加して返す
+        return f"{role}: {msg.content}\n{kw_tail}"
+    # タプル形式の場合 - エラーを発生させる
+    elif isinstance(msg, tuple):
+        raise ValueError("タプル形式のメッセージはサポートされていません。LangChainのメッセージオブジェクトを使用してください。")
+    # 辞書形式の場合 - エラーを発生させる
+    elif isinstance(msg, dict):
+        raise ValueError("辞書形式のメッセージはサポートされていません。LangChainのメッセージオブジェクトを使用してください。")
+    # その他の形式 - エラーを発生させる
+    else:
+        raise ValueError(f"サポートされていないメッセージ形式です: {type(msg)}")
+
+# 会話履歴を抽出する関数
+def extract_conversation_history(messages):
+    """
+    messagesリストから会話履歴を抽出する関数
+
+    Args:
+        messages (list): メッセージのリスト
+
+    Returns:
+        str: 整形された会話履歴
+
+    Raises:
+        ValueError: サポートされていないメッセージ形式の場合
+    """
+    return "\n\n".join([_format_message(msg) for msg in messages])
+
+# 最新のユーザー入力を取得する関数
+def get_latest_user_input(messages):
+    """
+    messagesリストから最新のユーザー入力を取得する関数
+
+    Args:
+        messages (list): メッセージのリスト
+
+    Returns:
+        dict: 最新のユーザー入力情報
+
+    Raises:
+        ValueError: サポートされていないメッセージ形式の場合
+    """
+    # 最新のHumanMessageを末尾から探す
+    for msg in reversed(messages):
+        # LangChainのHumanMessageオブジェクトの場合（type属性の取得は1回のみ）
+        if getattr(msg, 'type', None) == "human" and hasattr(msg, 'content'):
+            # additional_kwargsから値が空でない情報をすべて取得
+            kw = getattr(msg, 'additional_kwargs', None)
+            result = {'content': msg.content}
+            if kw and isinstance(kw, dict):
+                result.update({key: value for key, value in kw.items() if value})
+            return result
+        # タプル形式の場合 - エラーを発生させる
+        elif type(msg) is tuple:
+            raise ValueError("タプル形式のメッセージはサポートされていません。LangChainのメッセージオブジェクトを使用してください。")
+
+    # ユーザーメッセージが見つからない場合は空の辞書を返す
+    return {'content': ''}
+
+# メッセージのadditional_kwargsに含めるノード情報を作成する関数
+def make_node_info(node_name, node_type, timestamp=None):
+    """
+    メッセージのadditional_kwargsに含めるnode_infoを作成する関数
+
+    Args:
+        node_name (str): ノード名（例: "output_node"）
+        node_type (str): ノードタイプ（例: "user_facing", "internal"）
+        timestamp (str, optional): ISO形式のタイムスタンプ（省略時は現在時刻）。
+            同じ処理で作成する複数のメッセージに同じ時刻を記録する場合に指定する
+
+    Returns:
+        dict: node_name, node_type, timestampを含むノード情報
+    """
+    return {
+        "node_name": node_name,
+        "node_type": node_type,
+        "timestamp": timestamp if timestamp is not None else datetime.now().isoformat(),
+    }
@@ -2,6 +2,7 @@
 メッセージ検証ユーティリティモジュール
 メッセージの型検査と検証を行う機能を提供
 """
+import logging
 from typing import Any, Dict, List, Optional, Union
 from langchain.schema import (
     HumanMessage, 
@@ -10,68 +11,83 @@ from langchain.schema import (
     FunctionMessage,
     BaseMessage
 )
+from langchain.schema.messages import ToolMessage
+
+# 検証成功などの経過情報はDEBUGレベルでログに出力する
+logger = logging.getLogger(__name__)
+
+# 各ノードが作成するメッセージクラス（これらのクラスそのものであればisinstanceによる検査を省く）
+_ALLOWED = frozenset({HumanMessage, AIMessage, SystemMessage, FunctionMessage, ToolMessage})
+
+# node_infoの必須フィールド
+_REQUIRED_NODE_INFO_FIELDS = frozenset({"node_name", "node_type", "timestamp"})
 
 class MessageValidationError(Exception):
     """メッセージ検証エラー"""
     pass
 
-class MessageValidator:
-    """メッセージの検証を行うクラス"""
+def validate_message(msg: Any) -> None:
+    """
+    メッセージを検証し、無効な場合は例外を発生させる
     
-    @staticmethod
-    def validate_message(msg: Any) -> None:
-        """
-        メッセージを検証し、無効な場合は例外を発生させる
-        
-        Args:
-            msg (Any): 検証するメッセージ
-            
-        Raises:
-            MessageValidationError: メッセージが無効な場合
-        """
-        # LangChainのBaseMessageを継承しているか確認
-        if not isinstance(msg, BaseMessage):
-            raise MessageValidationError(f"無効なメッセージ形式です: {type(msg)}。LangChainのメッセージオブジェクトを使用してください。")
+    Args:
+        msg (Any): 検証するメッセージ
         
-        # additional_kwargsが辞書型であることを確認
-        if not hasattr(msg, 'additional_kwargs') or not isinstance(msg.additional_kwargs, dict):
-            raise MessageValidationError(f"メッセージにadditional_kwargsがないか、辞書型ではありません: {type(msg)}")
-        
-        # node_infoが存在することを確認
-        if "node_info" not in msg.additional_kwargs:
-            raise MessageValidationError(f"メッセージにnode_info情報がありません: {msg.type}")
-        
-        # node_infoが辞書型であることを確認
-        node_info = msg.additional_kwargs["node_info"]
-        if not isinstance(node_info, dict):
-            raise MessageValidationError(f"node_infoが辞書型ではありません: {type(node_info)}")
-        
-        # 必須フィールドが存在することを確認
-        required_fields = ["node_name", "node_type", "timestamp"]
-        for field in required_fields:
-            if field not in node_info:
-                raise MessageValidationError(f"node_infoに必須フィールド '{field}' がありません")
+    Raises:
+        MessageValidationError: メッセージが無効な場合
+    """
+    # LangChainのBaseMessageを継承しているか確認
+    # よく使うメッセージクラスそのものであれば、継承関係をたどるisinstanceを省く
+    if type(msg) not in _ALLOWED and not isinstance(msg, BaseMessage):
+        raise MessageValidationError(f"無効なメッセージ形式です: {type(msg)}。LangChainのメッセージオブジェクトを使用してください。")
     
-    @staticmethod
-    def validate_messages(messages: List[Any]) -> None:
-        """
-        メッセージリストを検証し、無効な場合は例外を発生させる
-        
-        Args:
-            messages (List[Any]): 検証するメッセージリスト
-            
-        Raises:
-            MessageValidationError: メッセージが無効な場合
-        """
-        if not isinstance(messages, list):
-            raise MessageValidationError(f"messagesがリスト型ではありません: {type(messages)}")
-        
-        for i, msg in enumerate(messages):
-            try:
-                MessageValidator.validate_message(msg)
-            except MessageValidationError as e:
-                # インデックス情報を追加してエラーを再発生
-                raise MessageValidationError(f"メッセージ[{i}]が無効です: {str(e)}")
+    # additional_kwargsが辞書型であることを確認（LangChainは常にdictを作成する）
+    additional_kwargs = getattr(msg, 'additional_kwargs', None)
+    if type(additional_kwargs) is not dict:
+        raise MessageValidationError(f"メッセージにadditional_kwargsがないか、辞書型ではありません: {type(msg)}")
+    
+    # node_infoが存在することを確認
+    if "node_info" not in additional_kwargs:
+        raise MessageValidationError(f"メッセージにnode_info情報がありません: {msg.type}")
+    
+    # node_infoが辞書型であることを確認
+    node_info = additional_kwargs["node_info"]
+    if not isinstance(node_info, dict):
+        raise MessageValidationError(f"node_infoが辞書型ではありません: {type(node_info)}")
+    
+    # 必須フィールドが存在することを確認（dictのキービューとの集合演算で一度に調べる）
+    missing = _REQUIRED_NODE_INFO_FIELDS - node_info.keys()
+    if missing:
+        # 複数欠けている場合は、従来どおりnode_name, node_type, timestampの順で最初のものを報告する
+        raise MessageValidationError(f"node_infoに必須フィールド '{min(missing)}' がありません")
+
+def validate_messages(messages: List[Any]) -> None:
+    """
+    メッセージリストを検証し、無効な場合は例外を発生させる
+    
+    Args:
+        messages (List[Any]): 検証するメッセージリスト
         
-        # 検証成功時のメッセージ
-        print(f"メッセージ検証成功: {len(messages)}件のメッセージを検証しました")
+    Raises:
+        MessageValidationError: メッセージが無効な場合
+    """
+    if not isinstance(messages, list):
+        raise MessageValidationError(f"messagesがリスト型ではありません: {type(messages)}")
+    
+    for i, msg in enumerate(messages):
+        try:
+            validate_message(msg)
+        except MessageValidationError as e:
+            # インデックス情報を追加してエラーを再発生
+            raise MessageValidationError(f"メッセージ[{i}]が無効です: {str(e)}")
+    
+    # 検証成功時のメッセージ（%形式の引数は、DEBUGレベルが有効な場合のみ文字列に組み立てられる）
+    logger.debug("メッセージ検証成功: %d件のメッセージを検証しました", len(messages))
+
+class MessageValidator:
+    """
+    メッセージの検証を行うクラス（従来のMessageValidator.validate_messages()などの呼び出しとの互換用）
+    新しいコードではモジュールレベルのvalidate_message/validate_messagesを直接使用する
+    """
+    validate_message = staticmethod(validate_message)
+    validate_messages = staticmethod(validate_messages)
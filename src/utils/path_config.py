@@ -2,6 +2,9 @@ from pathlib import Path
 import os
 import logging
 
+# 初期化時の経過情報はDEBUGレベルでログに出力する
+logger = logging.getLogger(__name__)
+
 class PathConfigError(Exception):
     """パス設定関連のエラーを表すカスタム例外クラス"""
     pass
@@ -9,6 +12,29 @@ class PathConfigError(Exception):
 class PathConfig:
     """パス設定を管理するクラス"""
     
+    # インスタンスが持つ属性（__dict__を作らず、固定の属性のみを持つ）
+    # _instanceはクラス変数のため含めない
+    __slots__ = (
+        "app_dir",
+        "templates_dir",
+        "conversations_dir",
+        "profile_dir",
+        "prompts_dir",
+        "saved_index_dir",
+        "saved_models_dir",
+        "temp_voice_dir",
+        "api_logs_dir",
+        "certs_dir",
+        "memory_dir",
+        "chroma_db_dir",
+        "langmem_db_dir",
+        "state_logs_dir",
+        "settings_file",
+        "cert_file",
+        "key_file",
+        "_managed_dirs",
+    )
+    
     # シングルトンインスタンスを保持するクラス変数
     _instance = None
     
@@ -21,7 +47,7 @@ class PathConfig:
         """
         self.app_dir = app_dir
         
-        print('self.app_dir',self.app_dir)
+        logger.debug("app_dir: %s", self.app_dir)
 
         # 各種ディレクトリのパスを設定（app_dirはすでにsrcディレクトリ）
         self.templates_dir = self.app_dir / 'templates'
@@ -48,6 +74,23 @@ class PathConfig:
         # 証明書と秘密鍵のパスを設定
         self.cert_file = self.certs_dir / 'cert.pem'
         self.key_file = self.certs_dir / 'key.pem'
+        
+        # ensure_directoriesで作成するディレクトリ（親ディレクトリが先になるように並べる）
+        self._managed_dirs = (
+            self.templates_dir,
+            self.conversations_dir,
+            self.profile_dir,
+            self.prompts_dir,
+            self.saved_index_dir,
+            self.saved_models_dir,
+            self.temp_voice_dir,
+            self.api_logs_dir,
+            self.certs_dir,
+            self.memory_dir,
+            self.chroma_db_dir,
+            self.langmem_db_dir,
+            self.state_logs_dir
+        )
     
     @classmethod
     def initialize(cls, app_dir):
@@ -90,23 +133,22 @@ class PathConfig:
             - exist_ok=Trueにより、既存ディレクトリがあってもエラーになりません
             - ディレクトリ内の既存ファイルは一切変更されません
         """
-        directories = [
-            self.templates_dir,
-            self.conversations_dir,
-            self.profile_dir,
-            self.prompts_dir,
-            self.saved_index_dir,
-            self.saved_models_dir,
-            self.temp_voice_dir,
-            self.api_logs_dir,
-            self.certs_dir,
-            self.memory_dir,
-            self.chroma_db_dir,
-            self.langmem_db_dir,
-            self.state_logs_dir
-        ]
-        
-        for directory in directories:
-            if not directory.exists():
-                print(f"ディレクトリを作成します: {directory}")
+        # 親ディレクトリ（app_dir, memory_dir）ごとにos.scandirで一度だけ既存のエントリを調べ、
+        # 存在しないものだけmkdirする
+        # 従来のexists()による確認と同じく、同名のファイルがある場合もディレクトリの作成を行わない
+        existing_by_parent = {}
+        for directory in self._managed_dirs:
+            parent = directory.parent
+            existing = existing_by_parent.get(parent)
+            if existing is None:
+                try:
+                    with os.scandir(parent) as entries:
+                        existing = {entry.name for entry in entries}
+                except FileNotFoundError:
+                    existing = set()
+                existing_by_parent[parent] = existing
+            
+            if directory.name not in existing:
+                logger.debug("ディレクトリを作成します: %s", directory)
                 directory.mkdir(parents=True, exist_ok=True)
+                existing.add(directory.name)
@@ -2,12 +2,44 @@
 プロンプト関連のユーティリティモジュール
 プロンプトファイルの読み込みや管理を行う
 """
+import os
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional
 from utils.path_config import PathConfig
 
+# プロンプトディレクトリのパス（初回の呼び出し時にPathConfigから取得して保持する）
+_prompts_dir: Optional[Path] = None
+
+def _get_prompts_dir() -> Path:
+    """
+    プロンプトディレクトリのパスを取得する関数（PathConfigの参照は初回のみ）
+    
+    Returns:
+        Path: プロンプトディレクトリのパス
+    """
+    global _prompts_dir
+    if _prompts_dir is None:
+        _prompts_dir = PathConfig.get_instance().prompts_dir
+    return _prompts_dir
+
+@lru_cache(maxsize=128)
+def _read(path_str: str, mtime_ns: int) -> str:
+    """
+    ファイルを読み込む関数（パスと更新時刻ごとにキャッシュされる）
+    
+    更新時刻をキャッシュのキーに含めるため、実行中にプロンプトファイルを編集した場合は読み込み直される
+    """
+    with open(path_str, 'r', encoding='utf-8') as f:
+        return f.read()
+
 def load_prompt(prompt_file: str) -> str:
     """
     プロンプトファイルを読み込む関数
     
+    読み込んだ内容はファイルの更新時刻とともにキャッシュされ、
+    ファイルが変更されていなければ2回目以降はディスクから読み込まない。
+    
     Args:
         prompt_file (str): プロンプトファイルの名前
         
@@ -17,15 +49,25 @@ def load_prompt(prompt_file: str) -> str:
     Raises:
         FileNotFoundError: プロンプトファイルが見つからない場合
     """
-    # シングルトンインスタンスを取得
-    path_config = PathConfig.get_instance()
-    
     # プロンプトディレクトリからファイルパスを構築
-    prompt_path = path_config.prompts_dir / prompt_file
+    prompt_path = _get_prompts_dir() / prompt_file
     try:
-        with open(prompt_path, 'r', encoding='utf-8') as f:
-            return f.read()
+        path_str = str(prompt_path)
+        return _read(path_str, os.stat(path_str).st_mtime_ns)
     except FileNotFoundError:
         error_msg = f"エラー: {prompt_path}ファイルが見つかりません。"
         print(error_msg)
         raise FileNotFoundError(error_msg)
+
+def clear_prompt_cache() -> None:
+    """
+    キャッシュされているプロンプトの内容とプロンプトディレクトリのパスを破棄する関数
+    
+    開発中やテストで、次回の呼び出し時にプロンプトディレクトリとファイルを読み込み直させるために使用する
+    """
+    global _prompts_dir
+    _read.cache_clear()
+    _prompts_dir = None
+
+# 以前の呼び出し名との互換用（キャッシュはload_prompt自身が更新時刻とともに行う）
+load_prompt_cached = load_prompt
@@ -3,6 +3,49 @@ Stateオブジェクトの処理に関するユーティリティクラス
 """
 import re
 from typing import Dict, List, Any, Optional
+from langchain.schema import HumanMessage, AIMessage, SystemMessage
+
+# メッセージのcontentに混入したメタデータ（additional_kwargs={} response_metadata={} id='xxx'）
+_META_RE = re.compile(r"additional_kwargs=\{\}\s*response_metadata=\{\}\s*id='[^']*'")
+
+# 文字列形式のメッセージの先頭にある「role:」（前後の空白を許容し、contentは先頭の空白を除いて取り出す）
+_ROLE_PREFIX_RE = re.compile(r"\s*(system|user|assistant)\s*:\s*(.*)", re.DOTALL)
+
+# LangChainのメッセージクラスから会話履歴上のロールへの対応表
+_ROLE_BY_TYPE = {HumanMessage: "user", AIMessage: "assistant", SystemMessage: "system"}
+
+# 会話履歴の各行の先頭に付けるロールの接頭辞（行ごとに書式化せず、既存の文字列をそのまま連結する）
+_ROLE_PREFIX = {"user": "user: ", "assistant": "assistant: ", "system": "system: "}
+
+# LangChainのメッセージクラスから接頭辞への対応表（build_conversation_contextで型から直接引く）
+_PREFIX_BY_TYPE = {message_type: _ROLE_PREFIX[role] for message_type, role in _ROLE_BY_TYPE.items()}
+
+def build_conversation_context(messages: List[Any]) -> Optional[str]:
+    """
+    LangChainのメッセージ（Human/AI/System）のみからなるリストを会話履歴の文字列に整形する
+    
+    Args:
+        messages (List[Any]): メッセージのリスト
+        
+    Returns:
+        Optional[str]: 整形された会話履歴（Human/AI/System以外のメッセージが含まれる場合はNone）
+    """
+    # BaseMessageのインスタンスはメタデータを含まないcontentを保持しているため、正規表現による除去は
+    # 文字列化された旧形式のメッセージにのみ必要
+    parts = []
+    append = parts.append
+    prefix_of = _PREFIX_BY_TYPE.get
+    for message in messages:
+        # 型の判定と接頭辞の取得を1回の辞書参照で行い、対象外の型があればその時点で打ち切る
+        prefix = prefix_of(type(message))
+        if prefix is None:
+            return None
+        content = str(message.content)
+        if content:
+            append(prefix)
+            append(content.strip())
+            append("\n")
+    return "".join(parts)
 
 class StateUtils:
     """
@@ -10,6 +53,9 @@ class StateUtils:
     各ノードで共通して使用される処理をまとめています
     """
     
+    # インスタンスが持つ属性（__dict__を作らず、固定の属性のみを持つ）
+    __slots__ = ("max_messages", "max_files")
+    
     def __init__(self, max_messages=10, max_files=5):
         """
         初期化
@@ -37,81 +83,78 @@ class StateUtils:
         file_contents = state.get("file_contents", [])
         
         # 会話履歴を取得（すべてのメッセージを含む）
-        conversation_context = ""
-        if messages:
-            # すべてのメッセージを処理（制限なし）
+        # すべてがLangChainのメッセージ（Human/AI/System）の場合（ほとんどの呼び出し）は専用の関数で整形する
+        conversation_context = build_conversation_context(messages) if messages else ""
+        if conversation_context is None:
+            # タプル・辞書・文字列形式のメッセージが含まれる場合は、1件ずつ形式を判定して処理する
+            # 各行はリストに集め、最後に一度だけ連結する
+            context_parts = []
             for message in messages:
                 # メッセージの形式を確認
-                role = None
                 content = None
                 
-                # LangChainのメッセージクラスのインスタンスかどうかを確認
-                if hasattr(message, "__class__"):
-                    class_name = message.__class__.__name__
-                    if class_name in ["SystemMessage", "HumanMessage", "AIMessage"]:
-                        if class_name == "SystemMessage":
-                            role = "system"
-                        elif class_name == "HumanMessage":
-                            role = "user"
-                        elif class_name == "AIMessage":
-                            role = "assistant"
-                        
-                        if hasattr(message, "content"):
-                            content = str(message.content)
+                # LangChainのメッセージクラスのインスタンスかどうかを確認（型からロールを引く）
+                message_type = type(message)
+                role = _ROLE_BY_TYPE.get(message_type)
+                if role is not None:
+                    content = str(message.content)
                 
                 # タプル形式のメッセージかどうかを確認
-                elif isinstance(message, tuple) and len(message) == 2:
+                elif message_type is tuple and len(message) == 2:
                     role, content = message
                 
                 # 辞書形式のメッセージかどうかを確認
-                elif isinstance(message, dict) and "role" in message and "content" in message:
+                elif message_type is dict and "role" in message and "content" in message:
                     role = message["role"]
                     content = message["content"]
                 
                 # 文字列形式のメッセージかどうかを確認
-                elif isinstance(message, str):
-                    content = message
-                    # 文字列の先頭に「role:」形式があるか確認
-                    if ":" in message and message.split(":", 1)[0].strip() in ["system", "user", "assistant"]:
-                        parts = message.split(":", 1)
-                        role = parts[0].strip()
-                        content = parts[1].strip()
+                elif message_type is str:
+                    # 文字列の先頭に「role:」形式があるか確認（1回の正規表現の照合でロールとcontentを取り出す）
+                    match = _ROLE_PREFIX_RE.match(message)
+                    if match:
+                        role = match.group(1)
+                        content = match.group(2).rstrip()
                     else:
                         # デフォルトはユーザーメッセージとして扱う
                         role = "user"
+                        content = message
+                    
+                    # 文字列化されたメッセージに含まれるメタデータ（additional_kwargs={} response_metadata={} id='xxx'）を除去
+                    # 目印の文字列がない場合は正規表現を実行しない
+                    if "additional_kwargs={}" in content:
+                        content = _META_RE.sub("", content)
                 
-                # contentからメタデータを除去
                 if role and content:
                     if isinstance(content, str):
-                        # additional_kwargs={} response_metadata={} id='xxx' の形式を除去
-                        pattern = r"additional_kwargs=\{\}\s*response_metadata=\{\}\s*id='[^']*'"
-                        clean_content = re.sub(pattern, "", content).strip()
-                        conversation_context += f"{role}: {clean_content}\n"
+                        context_parts.append(_ROLE_PREFIX.get(role) or f"{role}: ")
+                        context_parts.append(content.strip())
+                        context_parts.append("\n")
                     else:
-                        conversation_context += f"{role}: {content}\n"
+                        context_parts.append(f"{role}: {content}\n")
+            conversation_context = "".join(context_parts)
         
         # ファイル内容の文脈を構築（制限なし）
         file_context = ""
         if file_contents:
-            file_context = "過去に共有されたファイル情報:\n"
             # すべてのファイルを処理
-            for i, file in enumerate(file_contents):
-                file_context += f"ファイル{i+1}: {file.get('filename', '不明')} - {file.get('description', '説明なし')}\n"
+            file_context = "過去に共有されたファイル情報:\n" + "".join(
+                f"ファイル{i+1}: {file.get('filename', '不明')} - {file.get('description', '説明なし')}\n"
+                for i, file in enumerate(file_contents)
+            )
         
-        # 画像内容の説明を取得
+        # 画像内容の説明を取得（interpretationは一度だけ取得する）
+        interpretation = processed_input.get('interpretation') or {}
         image_description = ""
-        interpretation = processed_input.get('interpretation', {})
         image_desc = interpretation.get('image_content_description', '')
         if image_desc and image_desc != "画像の内容を解析できませんでした":
             image_description = image_desc
-        
-        # 添付ファイル情報を取得
-        files_info = processed_input.get('interpretation', {}).get('files_info', 'なし')
+        files_info = interpretation.get('files_info', 'なし')
         
         # 抽出した情報を返す（デフォルト値を設定）
         return {
             "input_text": input_text,
-            "files_info": processed_input.get('interpretation', {}).get('files_info', 'なし'),
+            "files_info": files_info,
             "image_description": image_description,
             "conversation_context": conversation_context,
             "file_context": file_context